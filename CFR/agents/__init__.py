@@ -7,3 +7,4 @@ installed_packages = [r.decode().split('==')[0] for r in reqs.split()]
 
 from CFR.agents.cfr_agent import CFRAgent
 from CFR.agents.random_agent import RandomAgent
+from CFR.agents.parallel_cfr import ParallelCFRTrainer, SharedMemoryCFRTrainer
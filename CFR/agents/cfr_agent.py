@@ -1,34 +1,58 @@
 import numpy as np
-import collections
 
 import os
 import pickle
 
 from CFR.utils.utils import *
+from CFR.agents.infoset_table import InfosetTable, CompactInfosetTable
+from CFR.agents.infoset_table import regret_matching
+from CFR.agents.checkpoint import read_meta, resolve_checkpoint, save_checkpoint, load_checkpoint
+from CFR.envs.guandan import INFOSET_KEY_SIZE
 
 
 class CFRAgent():
     ''' Implement CFR (chance sampling) algorithm
     '''
 
-    def __init__(self, env, model_path='./cfr_model'):
+    def __init__(self, env, model_path='./cfr_model', compact=False, policy_update='full', table=None):
         ''' Initilize Agent
 
         Args:
             env (Env): Env class
+            model_path (str): The directory of the saved model
+            compact (boolean): True to store the values of every state_str
+                only for the legal actions seen there
+            policy_update (str): 'full' to recompute the policy of every
+                state_str after each iteration, 'incremental' to recompute
+                only the state_str whose regrets changed in the iteration,
+                'lazy' to recompute the policy of a state_str when it is read
+                after its regrets changed. In lazy mode a read sees the regrets
+                accumulated earlier in the same iteration
+            table (InfosetTable): The table to use instead of a new one, e.g.
+                a SharedInfosetTable attached by a worker process
         '''
         self.use_raw = False
         self.env = env
         self.model_path = model_path
-
-        # A policy is a dict state_str -> action probabilities
-        self.policy = collections.defaultdict(list)
-        self.average_policy = collections.defaultdict(np.array)
-
-        # Regret is a dict state_str -> action regrets
-        self.regrets = collections.defaultdict(np.array)
+        self.policy_update = policy_update
+
+        # The table interns state_str into a row index and keeps the action
+        # regrets, action probabilities and cumulative action probabilities
+        # of every state_str as rows of contiguous arrays
+        if table is not None:
+            self.table = table
+        elif compact:
+            self.table = CompactInfosetTable(self.env.num_actions)
+        else:
+            self.table = InfosetTable(self.env.num_actions)
 
         self.iteration = 0
+        # Scratch buffers of eval_step and sample_action
+        self._eval_probs = np.empty(self.env.num_actions)
+        self._sample_probs = np.empty(self.env.num_actions)
+        self._legal_mask = np.zeros(self.env.num_actions, dtype=bool)
+        # The number of rows of the table in the checkpoint at model_path
+        self._checkpoint_rows = None
 
     def train(self):
         """
@@ -37,14 +61,20 @@ class CFRAgent():
         self.iteration += 1
         # Firstly, traverse tree to compute counterfactual regret for each player
         # The regrets are recorded in traversal
+        self.sample_traversals()
+
+        # Update policy
+        self.update_policy()
+
+    def sample_traversals(self):
+        """
+        Traverse one sampled game for every player with the current policy
+        """
         for player_id in range(self.env.num_players):
             self.env.reset()
             probs = np.ones(self.env.num_players)
             self.traverse_tree(probs, player_id)
 
-        # Update policy
-        self.update_policy()
-
     def traverse_tree(self, probs, player_id):
         ''' Traverse the game tree, update the regrets
 
@@ -62,12 +92,11 @@ class CFRAgent():
         # print("current_player", current_player)
         action_utilities = {}
         state_utility = np.zeros(self.env.num_players)
-        obs, legal_actions = self.get_state(current_player)
-        action_probs = self.action_probs(obs, legal_actions, self.policy)
-
-        action = np.random.choice(len(action_probs), p=action_probs)
-        # for action in legal_actions[:1]:
-        action_prob = action_probs[action]
+        state = self.env.get_state(current_player)
+        obs, legal_actions = self.infoset_key(state), state['legal_actions']
+        # Only the sampled action and its probability are needed, so the
+        # probabilities are not normalized into a new array
+        action, action_prob = self.sample_action(obs, legal_actions, 'policy', state.get('legal_mask'))
         new_probs = probs.copy()
         new_probs[current_player] *= action_prob
 
@@ -88,64 +117,100 @@ class CFRAgent():
                                np.prod(probs[current_player + 1:]))
         player_state_utility = state_utility[current_player]
 
-        if obs not in self.regrets:
-            self.regrets[obs] = np.zeros(self.env.num_actions)
-        if obs not in self.average_policy:
-            self.average_policy[obs] = np.zeros(self.env.num_actions)
+        row = self.table.intern(obs, legal_actions)
         # for action in legal_actions:
-        action_prob = action_probs[action]
         regret = counterfactual_prob * (action_utilities[action][current_player]
                                         - player_state_utility)
-        self.regrets[obs][action] += regret
-        self.average_policy[obs][action] += self.iteration * player_prob * action_prob
+        self.table.accumulate(row, action, regret, self.iteration * player_prob * action_prob)
         return state_utility
 
     def update_policy(self):
         ''' Update policy based on the current regrets
         '''
-        for obs in self.regrets:
-            self.policy[obs] = self.regret_matching(obs)
+        if self.policy_update == 'lazy':
+            # The touched rows are recomputed when they are read
+            return
+        if self.policy_update == 'incremental':
+            self.table.update_policy(self.table.touched)
+        else:
+            self.table.update_policy()
 
-    def regret_matching(self, obs):
+    def regret_matching(self, row):
         ''' Apply regret matching
 
         Args:
-            obs (string): The state_str
-        '''
-        regret = self.regrets[obs]
-        positive_regret_sum = sum([r for r in regret if r > 0])
+            row (int): The row of the state_str in the table
 
-        action_probs = np.zeros(self.env.num_actions)
-        if positive_regret_sum > 0:
-            for action in range(self.env.num_actions):
-                action_probs[action] = max(0.0, regret[action] / positive_regret_sum)
-        else:
-            for action in range(self.env.num_actions):
-                action_probs[action] = 1.0 / self.env.num_actions
-        return action_probs
+        Returns:
+            (numpy.array): The action probabilities
+        '''
+        return regret_matching(self.table.dense('regrets', row)[np.newaxis])[0]
 
-    def action_probs(self, obs, legal_actions, policy):
+    def action_probs(self, obs, legal_actions, policy, legal_mask=None, out=None):
         ''' Obtain the action probabilities of the current state
 
         Args:
             obs (str): state_str
             legal_actions (list): List of leagel actions
-            player_id (int): The current player
-            policy (dict): The used policy
+            policy (str): The used policy, 'policy' or 'average_policy'
+            legal_mask (numpy.array): The legal action mask of the state, if
+                the env gives one. The illegal actions are then masked out
+                in place
+            out (numpy.array): A float array to write the probabilities into
+                instead of a new one
 
         Returns:
             (tuple) that contains:
                 action_probs(numpy.array): The action probabilities
                 legal_actions (list): Indices of legal actions
         '''
-        if obs not in policy.keys():
-            action_probs = np.array([1.0 / self.env.num_actions for _ in range(self.env.num_actions)])
-            self.policy[obs] = action_probs
+        row = self.table.lookup(obs)
+        if row is None:
+            action_probs = np.full(self.env.num_actions, 1.0 / self.env.num_actions)
         else:
-            action_probs = policy[obs]
-        action_probs = remove_illegal(action_probs, legal_actions)
+            if policy == 'policy' and self.policy_update == 'lazy' and row in self.table.touched:
+                self.table.update_policy((row,))
+            action_probs = self.table.dense(policy, row)
+        if legal_mask is not None:
+            if out is None:
+                out = np.empty(self.env.num_actions)
+            return masked_probs(action_probs, legal_mask, out=out)
+        action_probs = remove_illegal(action_probs, legal_actions, out=out)
         return action_probs
 
+    def sample_action(self, obs, legal_actions, policy, legal_mask=None):
+        ''' Sample a legal action of the current state
+
+        The policy row is masked and summed up in a scratch buffer, so no
+        probability vector is allocated.
+
+        Args:
+            obs (str): state_str
+            legal_actions (list): List of leagel actions
+            policy (str): The used policy, 'policy' or 'average_policy'
+            legal_mask (numpy.array): The legal action mask of the state, if
+                the env gives one. Otherwise it is built from legal_actions
+
+        Returns:
+            (tuple) that contains:
+                action (int): The sampled action
+                action_prob (float): Its probability among the legal actions
+        '''
+        row = self.table.lookup(obs)
+        if row is None:
+            # Uniform over the legal actions
+            return legal_actions[np.random.randint(len(legal_actions))], 1.0 / len(legal_actions)
+        if policy == 'policy' and self.policy_update == 'lazy' and row in self.table.touched:
+            self.table.update_policy((row,))
+        if legal_mask is None:
+            legal_mask = self._legal_mask
+            legal_mask[:] = False
+            legal_mask[legal_actions] = True
+        cumulative = self._sample_probs
+        action = sample_masked(self.table.dense(policy, row), legal_mask, cumulative)
+        previous = cumulative[action - 1] if action > 0 else 0.0
+        return action, float((cumulative[action] - previous) / cumulative[-1])
+
     def eval_step(self, state):
         ''' Given a state, predict action based on average policy
 
@@ -156,8 +221,14 @@ class CFRAgent():
             action (int): Predicted action
             info (dict): A dictionary containing information
         '''
-        probs = self.action_probs(state['obs'].tostring(), state['legal_actions'], self.average_policy)
-        action = np.random.choice(len(probs), p=probs)
+        legal_mask = state.get('legal_mask')
+        probs = self.action_probs(self.infoset_key(state), state['legal_actions'], 'average_policy',
+                                  legal_mask, self._eval_probs)
+        if legal_mask is None:
+            legal_mask = self._legal_mask
+            legal_mask[:] = False
+            legal_mask[state['legal_actions']] = True
+        action = sample_masked(probs, legal_mask, self._sample_probs)
 
         info = {}
         info['probs'] = {state['raw_legal_actions'][i]: float(probs[state['legal_actions'][i]]) for i in
@@ -177,51 +248,119 @@ class CFRAgent():
                 legal_actions (list): Indices of legal actions
         '''
         state = self.env.get_state(player_id)
-        return state['obs'].tostring(), state['legal_actions']
+        return self.infoset_key(state), state['legal_actions']
+
+    @staticmethod
+    def infoset_key(state):
+        ''' Get the key of the infoset of a state in the table
 
-    def save(self):
+        Args:
+            state (dict): The state given by the env
+
+        Returns:
+            (bytes): The infoset key of the env as INFOSET_KEY_SIZE bytes
+        '''
+        return state['infoset_key'].to_bytes(INFOSET_KEY_SIZE, 'little')
+
+    def save(self, writer=None):
         ''' Save model
+
+        Dense tables are written as a memory-mapped checkpoint, where only the
+        rows added or changed since the last save are written. Compact tables
+        are pickled.
+
+        Args:
+            writer (CheckpointWriter): If given, only a snapshot is taken here
+                and the writer stores it as a new version under model_path in
+                the background. load() reads the newest version
         '''
         if not os.path.exists(self.model_path):
             os.makedirs(self.model_path)
+        if self.policy_update == 'lazy':
+            self.table.update_policy(self.table.touched)
+
+        if writer is not None:
+            if isinstance(self.table, CompactInfosetTable):
+                writer.submit_files({
+                    'table.pkl': pickle.dumps(self.table, protocol=pickle.HIGHEST_PROTOCOL),
+                    'iteration.pkl': pickle.dumps(self.iteration)})
+            else:
+                self._checkpoint_rows = writer.submit(self.table, self.iteration,
+                                                      self._checkpoint_rows, self.table.unsaved)
+                self.table.unsaved.clear()
+            return
 
-        policy_file = open(os.path.join(self.model_path, 'policy.pkl'), 'wb')
-        pickle.dump(self.policy, policy_file)
-        policy_file.close()
-
-        average_policy_file = open(os.path.join(self.model_path, 'average_policy.pkl'), 'wb')
-        pickle.dump(self.average_policy, average_policy_file)
-        average_policy_file.close()
+        if isinstance(self.table, CompactInfosetTable):
+            table_file = open(os.path.join(self.model_path, 'table.pkl'), 'wb')
+            pickle.dump(self.table, table_file, protocol=pickle.HIGHEST_PROTOCOL)
+            table_file.close()
 
-        regrets_file = open(os.path.join(self.model_path, 'regrets.pkl'), 'wb')
-        pickle.dump(self.regrets, regrets_file)
-        regrets_file.close()
+            iteration_file = open(os.path.join(self.model_path, 'iteration.pkl'), 'wb')
+            pickle.dump(self.iteration, iteration_file)
+            iteration_file.close()
+            return
 
-        iteration_file = open(os.path.join(self.model_path, 'iteration.pkl'), 'wb')
-        pickle.dump(self.iteration, iteration_file)
-        iteration_file.close()
+        self._checkpoint_rows = save_checkpoint(self.model_path, self.table, self.iteration,
+                                                self._checkpoint_rows, self.table.unsaved)
+        self.table.unsaved.clear()
 
-    def load(self):
+    def load(self, mmap=False):
         ''' Load model
+
+        Args:
+            mmap (boolean): True to memory-map a checkpoint read-only instead of
+                reading it into memory. This is meant for evaluation only
         '''
         if not os.path.exists(self.model_path):
             return
         print(self.model_path)
+        path = resolve_checkpoint(self.model_path)
+        if read_meta(path) is not None:
+            self.table, self.iteration = load_checkpoint(path, mmap=mmap)
+            self._checkpoint_rows = len(self.table)
+            self._convert_obs_keys()
+            return
+
+        table_path = os.path.join(path, 'table.pkl')
+        if os.path.exists(table_path):
+            table_file = open(table_path, 'rb')
+            self.table = pickle.load(table_file)
+            table_file.close()
+        else:
+            self.table = type(self.table).from_dicts(self.env.num_actions, *self._load_legacy_dicts())
+
+        iteration_file = open(os.path.join(path, 'iteration.pkl'), 'rb')
+        self.iteration = pickle.load(iteration_file)
+        iteration_file.close()
+        self._convert_obs_keys()
+
+    def _convert_obs_keys(self):
+        ''' Convert the keys of a model trained on obs.tostring() keys to
+            infoset keys
+        '''
+        if len(self.table) == 0 or len(self.table.keys[0]) == INFOSET_KEY_SIZE:
+            return
+        self.table.rekey(lambda key: self.env.get_infoset_key(key).to_bytes(INFOSET_KEY_SIZE, 'little'))
+        # The keys on disk are stale, so the next save writes everything
+        self._checkpoint_rows = None
+
+    def _load_legacy_dicts(self):
+        ''' Load the policy, average_policy and regrets dicts of the old
+            checkpoint format
+        '''
+        policy = {}
         policy_file = open(os.path.join(self.model_path, 'policy.pkl'), 'rb')
         try:
-            self.policy = pickle.load(policy_file)
+            policy = pickle.load(policy_file)
         except EOFError:
             pass
         policy_file.close()
 
         average_policy_file = open(os.path.join(self.model_path, 'average_policy.pkl'), 'rb')
-        self.average_policy = pickle.load(average_policy_file)
+        average_policy = pickle.load(average_policy_file)
         average_policy_file.close()
 
         regrets_file = open(os.path.join(self.model_path, 'regrets.pkl'), 'rb')
-        self.regrets = pickle.load(regrets_file)
+        regrets = pickle.load(regrets_file)
         regrets_file.close()
-
-        iteration_file = open(os.path.join(self.model_path, 'iteration.pkl'), 'rb')
-        self.iteration = pickle.load(iteration_file)
-        iteration_file.close()
+        return policy, average_policy, regrets
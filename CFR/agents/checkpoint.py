@@ -0,0 +1,444 @@
+''' Memory-mapped checkpoints of infoset tables
+
+A checkpoint is a directory with
+    meta.json: the number of rows, the key size, the action space size, the
+               dtype of every value file and the iteration
+    keys.bin: the fixed-width infoset keys, one after another
+    regrets.bin, policy.bin, average_policy.bin: one fixed-width row of
+               num_actions values per key
+
+The policy is stored as float32. The regrets and the average policy are
+sums of products of reach probabilities and often lie far below the
+smallest float32, so they are kept as float64.
+
+Rows are only ever appended, so a later save writes the new rows at the
+end of the files and rewrites the changed rows in place. meta.json is
+replaced last, and rows past its row count are ignored on load.
+
+CheckpointWriter keeps versioned checkpoint directories checkpoint-NNNNNN
+under one model directory, and a LATEST file naming the newest one. A
+version hard-links the files of the version before it and appends its new
+rows to them, which the older version never reads. Its changed rows go to
+    delta_rows.bin: the patched rows, as int64
+    delta-regrets.bin, delta-policy.bin, delta-average_policy.bin: the
+               values of the patched rows
+which load_checkpoint applies over the rows of the value files.
+'''
+import json
+import os
+import queue
+import shutil
+import threading
+
+import numpy as np
+
+from CFR.agents.infoset_table import InfosetTable
+
+VALUE_DTYPES = {'regrets': 'float64', 'policy': 'float32', 'average_policy': 'float64'}
+LATEST_FILE = 'LATEST'
+VERSION_PREFIX = 'checkpoint-'
+DELTA_ROWS_FILE = 'delta_rows.bin'
+DELTA_PREFIX = 'delta-'
+
+
+def resolve_checkpoint(path):
+    ''' Get the directory of the newest checkpoint in a model directory
+
+    Args:
+        path (str): The model directory
+
+    Returns:
+        (str): The newest version written by a CheckpointWriter, or path
+               itself if there are no versions
+    '''
+    latest_path = os.path.join(path, LATEST_FILE)
+    if not os.path.exists(latest_path):
+        return path
+    with open(latest_path, 'r') as file:
+        return os.path.join(path, file.read().strip())
+
+
+def read_meta(path):
+    ''' Read the meta data of a checkpoint
+
+    Args:
+        path (str): The checkpoint directory
+
+    Returns:
+        (dict): The meta data, or None if there is no checkpoint in path
+    '''
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as file:
+        return json.load(file)
+
+
+def _write_meta(path, meta):
+    tmp_path = os.path.join(path, 'meta.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+
+def take_snapshot(table, iteration, saved_rows=0, changed_rows=()):
+    ''' Copy what a checkpoint needs from a table
+
+    Only the rows added since saved_rows and the changed rows are copied, so
+    this is cheap enough to run between two training iterations. The
+    snapshot stays consistent while the table keeps changing.
+
+    Args:
+        table (InfosetTable): The table
+        iteration (int): The iteration of the agent
+        saved_rows (int): The number of rows of the table already in the
+                          checkpoint the snapshot will be written on
+        changed_rows (iterable): Rows below saved_rows whose values changed
+
+    Returns:
+        (dict): The snapshot
+    '''
+    size = len(table)
+    changed_rows = sorted(row for row in changed_rows if row < saved_rows)
+    return {
+        'iteration': iteration,
+        'num_actions': table.num_actions,
+        'rows': size,
+        'saved_rows': saved_rows,
+        'key_size': len(table.keys[0]) if size > 0 else 0,
+        'keys': b''.join(table.keys[row] for row in range(saved_rows, size)),
+        'new': {name: table.rows(name)[saved_rows:size].astype(dtype)
+                for name, dtype in VALUE_DTYPES.items()},
+        'changed_rows': changed_rows,
+        'changed': {name: table.rows(name, changed_rows).astype(dtype)
+                    for name, dtype in VALUE_DTYPES.items()},
+    }
+
+
+def write_snapshot(path, snapshot):
+    ''' Write a snapshot on top of the checkpoint it was taken against
+
+    Args:
+        path (str): The checkpoint directory. It must hold exactly the
+                    saved_rows of the snapshot, or nothing if saved_rows is 0
+        snapshot (dict): The snapshot returned by take_snapshot
+    '''
+    if not os.path.exists(path):
+        os.makedirs(path)
+    saved_rows = snapshot['saved_rows']
+    num_actions = snapshot['num_actions']
+    mode = 'wb' if saved_rows == 0 else 'r+b'
+
+    with open(os.path.join(path, 'keys.bin'), mode) as file:
+        file.seek(saved_rows * snapshot['key_size'])
+        file.write(snapshot['keys'])
+        file.truncate()
+
+    changed_rows = snapshot['changed_rows']
+    for name, dtype in VALUE_DTYPES.items():
+        file_path = os.path.join(path, name + '.bin')
+        with open(file_path, mode) as file:
+            file.seek(saved_rows * num_actions * np.dtype(dtype).itemsize)
+            file.write(snapshot['new'][name].tobytes())
+            file.truncate()
+        if changed_rows:
+            values = np.memmap(file_path, dtype=dtype, mode='r+', shape=(saved_rows, num_actions))
+            values[changed_rows] = snapshot['changed'][name]
+            values.flush()
+            del values
+
+    _write_meta(path, {'rows': snapshot['rows'], 'key_size': snapshot['key_size'],
+                       'num_actions': num_actions, 'iteration': snapshot['iteration'],
+                       'dtypes': VALUE_DTYPES})
+
+
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        # 文件系统不支持硬链接
+        shutil.copyfile(source, target)
+
+
+def _append_rows(file_path, offset, data):
+    with open(file_path, 'r+b') as file:
+        file.seek(offset)
+        file.write(data)
+        file.truncate()
+
+
+def _read_delta(path, meta):
+    ''' Read the delta of a checkpoint
+
+    Returns:
+        (tuple): (sorted int64 array of the patched rows,
+                  dict of value name -> values of the patched rows)
+    '''
+    num_rows = meta.get('delta_rows', 0)
+    num_actions = meta['num_actions']
+    if num_rows == 0:
+        return (np.zeros(0, dtype=np.int64),
+                {name: np.zeros((0, num_actions), dtype=meta['dtypes'][name]) for name in VALUE_DTYPES})
+    rows = np.fromfile(os.path.join(path, DELTA_ROWS_FILE), dtype=np.int64, count=num_rows)
+    values = {}
+    for name in VALUE_DTYPES:
+        values[name] = np.fromfile(os.path.join(path, DELTA_PREFIX + name + '.bin'),
+                                   dtype=meta['dtypes'][name],
+                                   count=num_rows * num_actions).reshape(num_rows, num_actions)
+    return rows, values
+
+
+def write_version(base_path, path, snapshot, max_delta=0.25):
+    ''' Write a snapshot as a new version of the checkpoint it was taken against
+
+    The files of the base checkpoint are hard-linked, not copied, and the
+    new rows are appended to them. The changed rows, and the rows the delta
+    of the base already patched, go to the delta files of the new version.
+    Once the delta holds more than max_delta of the rows, the value files
+    are copied with the delta applied and the delta starts over. Either way
+    the bytes written stay proportional to the rows added or changed, not
+    to the size of the table.
+
+    Args:
+        base_path (str): The checkpoint the snapshot was taken against. It
+                         must hold exactly the saved_rows of the snapshot
+        path (str): The directory of the new version. It must not exist
+        snapshot (dict): The snapshot returned by take_snapshot
+        max_delta (float): The largest fraction of the rows in the delta
+    '''
+    os.makedirs(path)
+    saved_rows = snapshot['saved_rows']
+    num_actions = snapshot['num_actions']
+    delta_rows, delta_values = _read_delta(base_path, read_meta(base_path))
+    changed_rows = np.array(snapshot['changed_rows'], dtype=np.int64)
+    rows = np.union1d(delta_rows, changed_rows)
+    rebase = len(rows) > max_delta * snapshot['rows']
+
+    # 行只会追加, 基础版本只读取它自己的行数, 所以可以共用 keys.bin
+    _link(os.path.join(base_path, 'keys.bin'), os.path.join(path, 'keys.bin'))
+    _append_rows(os.path.join(path, 'keys.bin'), saved_rows * snapshot['key_size'], snapshot['keys'])
+
+    for name, dtype in VALUE_DTYPES.items():
+        file_path = os.path.join(path, name + '.bin')
+        values = np.zeros((len(rows), num_actions), dtype=dtype)
+        values[np.searchsorted(rows, delta_rows)] = delta_values[name]
+        values[np.searchsorted(rows, changed_rows)] = snapshot['changed'][name]
+        if rebase:
+            shutil.copyfile(os.path.join(base_path, name + '.bin'), file_path)
+        else:
+            _link(os.path.join(base_path, name + '.bin'), file_path)
+        _append_rows(file_path, saved_rows * num_actions * np.dtype(dtype).itemsize,
+                     snapshot['new'][name].tobytes())
+        if not rebase:
+            values.tofile(os.path.join(path, DELTA_PREFIX + name + '.bin'))
+        elif len(rows) > 0:
+            array = np.memmap(file_path, dtype=dtype, mode='r+', shape=(saved_rows, num_actions))
+            array[rows] = values
+            array.flush()
+            del array
+    if not rebase:
+        rows.tofile(os.path.join(path, DELTA_ROWS_FILE))
+
+    _write_meta(path, {'rows': snapshot['rows'], 'key_size': snapshot['key_size'],
+                       'num_actions': num_actions, 'iteration': snapshot['iteration'],
+                       'dtypes': VALUE_DTYPES, 'delta_rows': 0 if rebase else len(rows)})
+
+
+def save_checkpoint(path, table, iteration, saved_rows=None, changed_rows=()):
+    ''' Write a table to a checkpoint directory
+
+    Args:
+        path (str): The checkpoint directory
+        table (InfosetTable): The table
+        iteration (int): The iteration of the agent
+        saved_rows (int): The number of rows of the table that are already in
+                          the checkpoint. None writes the whole table again
+        changed_rows (iterable): Rows below saved_rows whose values changed
+
+    Returns:
+        (int): The number of rows in the checkpoint
+    '''
+    size = len(table)
+    key_size = len(table.keys[0]) if size > 0 else 0
+    meta = read_meta(path)
+    if (saved_rows is None or meta is None or meta['rows'] != saved_rows
+            or meta['num_actions'] != table.num_actions or meta['key_size'] not in (0, key_size)
+            or meta['dtypes'] != VALUE_DTYPES or meta.get('delta_rows', 0) > 0):
+        saved_rows = 0
+    write_snapshot(path, take_snapshot(table, iteration, saved_rows, changed_rows))
+    return size
+
+
+def load_checkpoint(path, mmap=False):
+    ''' Load a table from a checkpoint directory
+
+    Args:
+        path (str): The checkpoint directory
+        mmap (boolean): True to memory-map the value arrays read-only instead
+                        of reading them, e.g. to evaluate a model. Rows are then
+                        paged in on access and the table can not be trained
+
+    Returns:
+        (tuple): (InfosetTable, iteration)
+    '''
+    meta = read_meta(path)
+    rows, key_size, num_actions = meta['rows'], meta['key_size'], meta['num_actions']
+    keys = []
+    if rows > 0:
+        with open(os.path.join(path, 'keys.bin'), 'rb') as file:
+            data = file.read(rows * key_size)
+        keys = [data[i:i + key_size] for i in range(0, rows * key_size, key_size)]
+
+    delta_rows, delta_values = _read_delta(path, meta)
+    patch = len(delta_rows) > 0
+    values = []
+    for name in VALUE_DTYPES:
+        dtype = meta['dtypes'][name]
+        if rows == 0:
+            array = np.zeros((0, num_actions), dtype=dtype)
+        else:
+            # 有 delta 时用写时复制的映射, 只有被修改的页会复制到内存
+            array = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype,
+                              mode='c' if mmap and patch else 'r', shape=(rows, num_actions))
+        if not mmap:
+            array = np.array(array, dtype=np.float64)
+        if patch:
+            array[delta_rows] = delta_values[name]
+            if mmap:
+                array.flags.writeable = False
+        values.append(array)
+    regrets, policy, average_policy = values
+    return InfosetTable.from_arrays(keys, regrets, policy, average_policy), meta['iteration']
+
+
+class CheckpointWriter(object):
+    ''' Write checkpoints on a background thread
+
+    submit takes a snapshot of the rows added or changed since the previous
+    submit, which is the only work done on the training thread. The thread
+    writes each version on top of the newest one with write_version, in a
+    temporary directory. Then it renames the
+    directory, points LATEST at it and removes versions beyond keep. A
+    crash therefore never leaves LATEST pointing at a partial checkpoint.
+    '''
+
+    def __init__(self, path, keep=3, max_pending=2):
+        ''' Start the writer thread
+
+        Args:
+            path (str): The model directory
+            keep (int): The number of versions to keep
+            max_pending (int): The number of snapshots that may wait to be
+                               written before submit blocks
+        '''
+        self.path = path
+        self.keep = keep
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._versions = sorted(name for name in os.listdir(path) if name.startswith(VERSION_PREFIX))
+        self._next_version = int(self._versions[-1][len(VERSION_PREFIX):]) + 1 if self._versions else 0
+        # The number of rows of the newest submitted table snapshot
+        meta = read_meta(resolve_checkpoint(path)) if self._versions else None
+        self._rows = meta['rows'] if meta is not None else None
+        # The directory of the newest submitted version. It exists once the
+        # version is written
+        self.submitted = None
+
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, table, iteration, saved_rows=None, changed_rows=()):
+        ''' Queue a new version of a table
+
+        Args:
+            table (InfosetTable): The table
+            iteration (int): The iteration of the agent
+            saved_rows (int): The number of rows of the table in the newest
+                              version. None writes the whole table again
+            changed_rows (iterable): Rows below saved_rows whose values changed
+
+        Returns:
+            (int): The number of rows of the queued version
+        '''
+        self._raise_error()
+        if saved_rows is None or saved_rows != self._rows:
+            saved_rows = 0
+        snapshot = take_snapshot(table, iteration, saved_rows, changed_rows)
+        self._rows = snapshot['rows']
+        self._queue.put(('table', snapshot, self._new_version()))
+        return snapshot['rows']
+
+    def submit_files(self, files):
+        ''' Queue a new version made of whole files
+
+        Args:
+            files (dict): file name -> bytes
+        '''
+        self._raise_error()
+        self._rows = None
+        self._queue.put(('files', files, self._new_version()))
+
+    def _new_version(self):
+        ''' Name the next version. Versions are written in submit order
+        '''
+        name = '{}{:06d}'.format(VERSION_PREFIX, self._next_version)
+        self._next_version += 1
+        self.submitted = os.path.join(self.path, name)
+        return name
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._write(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, kind, data, name):
+        tmp_path = os.path.join(self.path, '.' + name + '.tmp')
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        if kind == 'table':
+            if data['saved_rows'] > 0:
+                write_version(os.path.join(self.path, self._versions[-1]), tmp_path, data)
+            else:
+                write_snapshot(tmp_path, data)
+        else:
+            os.makedirs(tmp_path)
+            for file_name, content in data.items():
+                with open(os.path.join(tmp_path, file_name), 'wb') as file:
+                    file.write(content)
+        os.rename(tmp_path, os.path.join(self.path, name))
+
+        latest_tmp_path = os.path.join(self.path, LATEST_FILE + '.tmp')
+        with open(latest_tmp_path, 'w') as file:
+            file.write(name)
+        os.replace(latest_tmp_path, os.path.join(self.path, LATEST_FILE))
+
+        self._versions.append(name)
+        while len(self._versions) > self.keep:
+            shutil.rmtree(os.path.join(self.path, self._versions.pop(0)))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        ''' Wait until all the queued versions are written
+        '''
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        ''' Write the queued versions and stop the thread
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
@@ -0,0 +1,615 @@
+import numpy as np
+
+
+def regret_matching(regrets):
+    ''' Apply regret matching to a batch of regret vectors
+
+    Args:
+        regrets (numpy.array): A 2-D array with one regret vector per row
+
+    Returns:
+        (numpy.array): The action probabilities, proportional to the positive
+                       regrets, or uniform for rows without positive regret
+    '''
+    positive = np.maximum(regrets, 0.0)
+    positive_regret_sum = positive.sum(axis=1, keepdims=True)
+    has_positive = positive_regret_sum > 0
+    action_probs = positive / np.where(has_positive, positive_regret_sum, 1.0)
+    return np.where(has_positive, action_probs, 1.0 / regrets.shape[1])
+
+
+class InfosetTable(object):
+    ''' Store the regrets, current policy and average policy of all infosets
+
+    Every infoset key is interned once into a row index. The three vectors of
+    an infoset are rows of growable contiguous 2-D arrays, so adding an infoset
+    costs one dict entry instead of three dict entries and three heap arrays.
+    '''
+
+    def __init__(self, num_actions, capacity=1024, dtype=np.float64):
+        ''' Initialize the table
+
+        Args:
+            num_actions (int): The size of the action space
+            capacity (int): The number of rows allocated up front
+            dtype (numpy.dtype): The dtype of the value arrays
+        '''
+        self.num_actions = num_actions
+        self.dtype = dtype
+        self.index = {}
+        self.keys = []
+        self.size = 0
+        # Rows whose regrets changed since the last policy update
+        self.touched = set()
+        # Rows whose policy was recomputed since the last checkpoint
+        self.unsaved = set()
+        self._allocate(max(capacity, 1))
+
+    def _allocate(self, capacity):
+        ''' Allocate (or grow) the value arrays to the given capacity
+        '''
+        regrets = np.zeros((capacity, self.num_actions), dtype=self.dtype)
+        average_policy = np.zeros((capacity, self.num_actions), dtype=self.dtype)
+        policy = np.full((capacity, self.num_actions), 1.0 / self.num_actions, dtype=self.dtype)
+        if self.size > 0:
+            regrets[:self.size] = self.regrets[:self.size]
+            average_policy[:self.size] = self.average_policy[:self.size]
+            policy[:self.size] = self.policy[:self.size]
+        self.regrets = regrets
+        self.average_policy = average_policy
+        self.policy = policy
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def lookup(self, key):
+        ''' Get the row index of an infoset
+
+        Args:
+            key (bytes): The infoset key
+
+        Returns:
+            (int): The row index, or None if the infoset has not been seen
+        '''
+        return self.index.get(key)
+
+    def intern(self, key, legal_actions=None):
+        ''' Get the row index of an infoset, adding a new row if needed
+
+        Args:
+            key (bytes): The infoset key
+            legal_actions (list): Indices of legal actions. Unused by the
+                                  dense table
+
+        Returns:
+            (int): The row index
+        '''
+        row = self.index.get(key)
+        if row is None:
+            if self.size == self.capacity:
+                # Double the capacity so that growth is amortized O(1)
+                self._allocate(max(self.capacity * 2, 1))
+            row = self.size
+            self.index[key] = row
+            self.keys.append(key)
+            self.size += 1
+        return row
+
+    def accumulate(self, row, action, regret, average):
+        ''' Add to the regret and the cumulative probability of an action
+
+        Args:
+            row (int): The row index
+            action (int): The action id
+            regret (float): The regret to add
+            average (float): The probability mass to add to the average policy
+        '''
+        self.regrets[row, action] += regret
+        self.average_policy[row, action] += average
+        self.touched.add(row)
+
+    def dense(self, name, row):
+        ''' Get one row as a dense vector over the whole action space
+
+        Args:
+            name (str): One of 'regrets', 'policy' and 'average_policy'
+            row (int): The row index
+
+        Returns:
+            (numpy.array): The row. It is a view and must not be modified
+        '''
+        return getattr(self, name)[row]
+
+    def set_policy(self, row, action_probs):
+        ''' Set the current policy of one row
+
+        Args:
+            row (int): The row index
+            action_probs (numpy.array): The action probabilities
+        '''
+        self.policy[row] = action_probs
+
+    def update_policy(self, rows=None, chunk_size=4096):
+        ''' Recompute the current policy from the regrets by regret matching
+
+        Args:
+            rows (iterable): Row indexes to update. All rows if None
+            chunk_size (int): The number of rows computed at once, which
+                              bounds the size of the temporary arrays
+        '''
+        if rows is None:
+            for start in range(0, self.size, chunk_size):
+                end = min(start + chunk_size, self.size)
+                self.policy[start:end] = regret_matching(self.regrets[start:end])
+            # Rows that were not touched keep the same policy
+            self.unsaved.update(self.touched)
+            self.touched.clear()
+            return
+        rows = np.fromiter(rows, dtype=np.int64)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            self.policy[chunk] = regret_matching(self.regrets[chunk])
+        rows = rows.tolist()
+        self.unsaved.update(rows)
+        self.touched.difference_update(rows)
+
+    def snapshot_policy(self, rows):
+        ''' Copy the current policy of some rows, e.g. to send it to a worker
+
+        Args:
+            rows (list): Row indexes
+
+        Returns:
+            (tuple): The keys of the rows and their policy, for
+                     set_policy_snapshot
+        '''
+        return [self.keys[row] for row in rows], self.rows('policy', rows)
+
+    def set_policy_snapshot(self, snapshot):
+        ''' Set the policy of the rows of a snapshot, adding the missing rows
+
+        Args:
+            snapshot (tuple): The snapshot returned by snapshot_policy
+        '''
+        keys, policy = snapshot
+        for key, action_probs in zip(keys, policy):
+            self.set_policy(self.intern(key), action_probs)
+
+    def take_deltas(self):
+        ''' Take the regrets and average policy accumulated in the touched rows
+
+        The taken values are reset to zero, so the table can be used to
+        accumulate the next deltas.
+
+        Returns:
+            (list): A list of (key, action ids, regrets, average policy)
+                    tuples, one per touched row, holding the nonzero values
+        '''
+        deltas = []
+        for row in sorted(self.touched):
+            regrets = self.regrets[row]
+            average_policy = self.average_policy[row]
+            ids = np.flatnonzero((regrets != 0) | (average_policy != 0))
+            deltas.append((self.keys[row], ids.astype(np.int16), regrets[ids], average_policy[ids]))
+            regrets[ids] = 0
+            average_policy[ids] = 0
+        self.touched.clear()
+        return deltas
+
+    def merge_deltas(self, deltas):
+        ''' Add deltas taken from another table. The merged rows are touched
+
+        Args:
+            deltas (list): A list of (key, action ids, regrets, average policy)
+                           tuples as returned by take_deltas
+        '''
+        for key, ids, regrets, average_policy in deltas:
+            row = self.intern(key)
+            self.regrets[row, ids] += regrets
+            self.average_policy[row, ids] += average_policy
+            self.touched.add(row)
+
+    def rows(self, name, rows=None):
+        ''' Bulk access to the used rows of one of the value arrays
+
+        Args:
+            name (str): One of 'regrets', 'policy' and 'average_policy'
+            rows (list): Row indexes. All used rows if None
+
+        Returns:
+            (numpy.array): A view of the used rows if rows is None, otherwise
+                           a copy of the selected rows
+        '''
+        values = getattr(self, name)
+        if rows is None:
+            return values[:self.size]
+        return values[rows]
+
+    def rekey(self, convert):
+        ''' Replace the key of every row
+
+        Args:
+            convert (function): old key -> new key. Distinct keys must stay
+                                distinct
+        '''
+        self.keys = [convert(key) for key in self.keys]
+        self.index = {key: row for row, key in enumerate(self.keys)}
+
+    @classmethod
+    def from_arrays(cls, keys, regrets, policy, average_policy):
+        ''' Build a table on top of existing value arrays without copying them
+
+        Args:
+            keys (list): The key of every row
+            regrets (numpy.array): The regrets, one row per key
+            policy (numpy.array): The action probabilities, one row per key
+            average_policy (numpy.array): The cumulative action probabilities
+
+        Returns:
+            (InfosetTable): The table. Read-only arrays, such as read-only
+                            memory maps, give a read-only table
+        '''
+        table = cls.__new__(cls)
+        table.num_actions = regrets.shape[1]
+        table.dtype = regrets.dtype
+        table.keys = list(keys)
+        table.index = {key: row for row, key in enumerate(table.keys)}
+        table.size = table.capacity = len(table.keys)
+        table.touched = set()
+        table.unsaved = set()
+        table.regrets = regrets
+        table.policy = policy
+        table.average_policy = average_policy
+        return table
+
+    @classmethod
+    def from_dicts(cls, num_actions, policy, average_policy, regrets):
+        ''' Build a table from the dicts of the old checkpoint format
+
+        Args:
+            num_actions (int): The size of the action space
+            policy (dict): state_str -> action probabilities
+            average_policy (dict): state_str -> cumulative action probabilities
+            regrets (dict): state_str -> action regrets
+
+        Returns:
+            (InfosetTable): The table holding the same values
+        '''
+        table = cls(num_actions, capacity=max(len(policy), len(regrets), 1))
+        for name, values in (('policy', policy), ('average_policy', average_policy), ('regrets', regrets)):
+            array = getattr(table, name)
+            for key, value in values.items():
+                array[table.intern(key)] = value
+        return table
+
+    def __getstate__(self):
+        # Only pickle the used rows
+        state = self.__dict__.copy()
+        for name in ('regrets', 'policy', 'average_policy'):
+            state[name] = state[name][:self.size].copy()
+        state['capacity'] = self.size
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = {key: row for row, key in enumerate(self.keys)}
+        if self.capacity == 0:
+            self._allocate(1)
+
+
+class CompactInfosetTable(object):
+    ''' Store the values of every infoset only for the action ids seen there
+
+    Each row keeps a small sorted array of the legal action ids seen at the
+    infoset and a (3, len(ids)) array holding the regrets, current policy and
+    average policy of those ids. The policy mass of all other actions is one
+    shared fill value per row, which is 1 / num_actions while the policy is
+    uniform and 0 otherwise. Rows are expanded to dense vectors only on demand.
+    '''
+
+    REGRETS, POLICY, AVERAGE_POLICY = 0, 1, 2
+    _FIELDS = {'regrets': REGRETS, 'policy': POLICY, 'average_policy': AVERAGE_POLICY}
+
+    def __init__(self, num_actions, dtype=np.float64):
+        ''' Initialize the table
+
+        Args:
+            num_actions (int): The size of the action space
+            dtype (numpy.dtype): The dtype of the value arrays
+        '''
+        self.num_actions = num_actions
+        self.dtype = dtype
+        self.index = {}
+        self.keys = []
+        self.ids = []
+        self.values = []
+        self.fill = []
+        # Rows whose regrets changed since the last policy update
+        self.touched = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def size(self):
+        return len(self.keys)
+
+    def lookup(self, key):
+        ''' Get the row index of an infoset
+
+        Args:
+            key (bytes): The infoset key
+
+        Returns:
+            (int): The row index, or None if the infoset has not been seen
+        '''
+        return self.index.get(key)
+
+    def intern(self, key, legal_actions=None):
+        ''' Get the row index of an infoset, adding a new row if needed
+
+        Args:
+            key (bytes): The infoset key
+            legal_actions (list): Indices of legal actions at the infoset.
+                                  They are added to the ids of the row
+
+        Returns:
+            (int): The row index
+        '''
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.keys)
+            self.index[key] = row
+            self.keys.append(key)
+            self.ids.append(np.zeros(0, dtype=np.int16))
+            self.values.append(np.zeros((3, 0), dtype=self.dtype))
+            self.fill.append(1.0 / self.num_actions)
+        if legal_actions is not None:
+            self._add_ids(row, legal_actions)
+        return row
+
+    def _add_ids(self, row, actions):
+        ''' Make sure the given action ids have a slot in the row
+        '''
+        ids = self.ids[row]
+        new_ids = np.union1d(ids, np.asarray(actions, dtype=np.int16))
+        if len(new_ids) == len(ids):
+            return
+        values = np.zeros((3, len(new_ids)), dtype=self.dtype)
+        values[self.POLICY] = self.fill[row]
+        values[:, np.searchsorted(new_ids, ids)] = self.values[row]
+        self.ids[row] = new_ids
+        self.values[row] = values
+
+    def _slot(self, row, action):
+        ''' Get the position of an action id in the row, adding it if needed
+        '''
+        ids = self.ids[row]
+        slot = np.searchsorted(ids, action)
+        if slot == len(ids) or ids[slot] != action:
+            self._add_ids(row, [action])
+            slot = np.searchsorted(self.ids[row], action)
+        return slot
+
+    def accumulate(self, row, action, regret, average):
+        ''' Add to the regret and the cumulative probability of an action
+
+        Args:
+            row (int): The row index
+            action (int): The action id
+            regret (float): The regret to add
+            average (float): The probability mass to add to the average policy
+        '''
+        slot = self._slot(row, action)
+        values = self.values[row]
+        values[self.REGRETS, slot] += regret
+        values[self.AVERAGE_POLICY, slot] += average
+        self.touched.add(row)
+
+    def dense(self, name, row):
+        ''' Expand one row to a dense vector over the whole action space
+
+        Args:
+            name (str): One of 'regrets', 'policy' and 'average_policy'
+            row (int): The row index
+
+        Returns:
+            (numpy.array): The dense row
+        '''
+        field = self._FIELDS[name]
+        fill = self.fill[row] if field == self.POLICY else 0.0
+        result = np.full(self.num_actions, fill, dtype=self.dtype)
+        result[self.ids[row]] = self.values[row][field]
+        return result
+
+    def set_policy(self, row, action_probs):
+        ''' Set the current policy of one row
+
+        Args:
+            row (int): The row index
+            action_probs (numpy.array): The dense action probabilities
+        '''
+        nonzero = np.flatnonzero(action_probs)
+        if len(nonzero) < self.num_actions:
+            # Give every action with probability mass a slot
+            self._add_ids(row, nonzero)
+        ids = self.ids[row]
+        values = self.values[row]
+        values[self.POLICY] = action_probs[ids]
+        # Spread the mass of the actions without a slot evenly over them
+        rest = self.num_actions - len(ids)
+        self.fill[row] = (1.0 - values[self.POLICY].sum()) / rest if rest > 0 else 0.0
+
+    def update_policy(self, rows=None):
+        ''' Recompute the current policy from the regrets by regret matching
+
+        The regrets of all rows are concatenated so that the positive parts
+        and their per-row sums are computed by a few array operations.
+
+        Args:
+            rows (iterable): Row indexes to update. All rows if None
+        '''
+        if rows is None:
+            rows = range(len(self.keys))
+            self.touched.clear()
+        else:
+            rows = list(rows)
+            self.touched.difference_update(rows)
+        rows = [row for row in rows if len(self.ids[row]) > 0]
+        if not rows:
+            return
+        lengths = np.array([len(self.ids[row]) for row in rows])
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        positive = np.maximum(np.concatenate([self.values[row][self.REGRETS] for row in rows]), 0.0)
+        positive_regret_sum = np.add.reduceat(positive, offsets)
+        has_positive = positive_regret_sum > 0
+        uniform = 1.0 / self.num_actions
+        action_probs = np.where(np.repeat(has_positive, lengths),
+                                positive / np.repeat(np.where(has_positive, positive_regret_sum, 1.0), lengths),
+                                uniform)
+        for row, probs, positive_row in zip(rows, np.split(action_probs, offsets[1:]), has_positive):
+            self.values[row][self.POLICY] = probs
+            self.fill[row] = 0.0 if positive_row else uniform
+
+    def snapshot_policy(self, rows):
+        ''' Copy the current policy of some rows, e.g. to send it to a worker
+
+        The rows stay sparse: the ids and policy of all the rows are
+        concatenated CSR-style, with the fill value of every row.
+
+        Args:
+            rows (list): Row indexes
+
+        Returns:
+            (tuple): (keys, indptr, action ids, policy, fill), for
+                     set_policy_snapshot
+        '''
+        rows = list(rows)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(self.ids[row]) for row in rows])
+        ids = np.concatenate([self.ids[row] for row in rows] + [np.zeros(0, dtype=np.int16)])
+        policy = np.concatenate([self.values[row][self.POLICY] for row in rows]
+                                + [np.zeros(0, dtype=self.dtype)])
+        fill = np.array([self.fill[row] for row in rows], dtype=self.dtype)
+        return [self.keys[row] for row in rows], indptr, ids, policy, fill
+
+    def set_policy_snapshot(self, snapshot):
+        ''' Set the policy of the rows of a snapshot, adding the missing rows
+
+        Args:
+            snapshot (tuple): The snapshot returned by snapshot_policy
+        '''
+        keys, indptr, ids, policy, fill = snapshot
+        for i, key in enumerate(keys):
+            start, end = indptr[i], indptr[i + 1]
+            row = self.intern(key, ids[start:end])
+            # The row may have more ids than the snapshot, they get the fill value
+            values = self.values[row]
+            values[self.POLICY] = fill[i]
+            values[self.POLICY, np.searchsorted(self.ids[row], ids[start:end])] = policy[start:end]
+            self.fill[row] = fill[i]
+
+    def take_deltas(self):
+        ''' Take the regrets and average policy accumulated in the touched rows
+
+        The taken values are reset to zero, so the table can be used to
+        accumulate the next deltas.
+
+        Returns:
+            (list): A list of (key, action ids, regrets, average policy)
+                    tuples, one per touched row
+        '''
+        deltas = []
+        for row in sorted(self.touched):
+            values = self.values[row]
+            deltas.append((self.keys[row], self.ids[row],
+                           values[self.REGRETS].copy(), values[self.AVERAGE_POLICY].copy()))
+            values[self.REGRETS] = 0
+            values[self.AVERAGE_POLICY] = 0
+        self.touched.clear()
+        return deltas
+
+    def merge_deltas(self, deltas):
+        ''' Add deltas taken from another table. The merged rows are touched
+
+        Args:
+            deltas (list): A list of (key, action ids, regrets, average policy)
+                           tuples as returned by take_deltas
+        '''
+        for key, ids, regrets, average_policy in deltas:
+            row = self.intern(key, ids)
+            slots = np.searchsorted(self.ids[row], ids)
+            values = self.values[row]
+            values[self.REGRETS, slots] += regrets
+            values[self.AVERAGE_POLICY, slots] += average_policy
+            self.touched.add(row)
+
+    def rows(self, name, rows=None):
+        ''' Bulk access to rows of one of the value arrays
+
+        Args:
+            name (str): One of 'regrets', 'policy' and 'average_policy'
+            rows (list): Row indexes. All rows if None
+
+        Returns:
+            (numpy.array): The selected rows, expanded to dense vectors
+        '''
+        if rows is None:
+            rows = range(len(self.keys))
+        result = np.zeros((len(rows), self.num_actions), dtype=self.dtype)
+        for i, row in enumerate(rows):
+            result[i] = self.dense(name, row)
+        return result
+
+    def rekey(self, convert):
+        ''' Replace the key of every row
+
+        Args:
+            convert (function): old key -> new key. Distinct keys must stay
+                                distinct
+        '''
+        self.keys = [convert(key) for key in self.keys]
+        self.index = {key: row for row, key in enumerate(self.keys)}
+
+    @classmethod
+    def from_dicts(cls, num_actions, policy, average_policy, regrets):
+        ''' Build a table from the dicts of the old checkpoint format
+
+        Args:
+            num_actions (int): The size of the action space
+            policy (dict): state_str -> action probabilities
+            average_policy (dict): state_str -> cumulative action probabilities
+            regrets (dict): state_str -> action regrets
+
+        Returns:
+            (CompactInfosetTable): The table holding the same values
+        '''
+        table = cls(num_actions)
+        zeros = np.zeros(num_actions)
+        for key in list(regrets) + list(average_policy):
+            regret = regrets.get(key, zeros)
+            average = average_policy.get(key, zeros)
+            row = table.intern(key, np.flatnonzero((regret != 0) | (average != 0)))
+            ids = table.ids[row]
+            table.values[row][cls.REGRETS] = regret[ids]
+            table.values[row][cls.AVERAGE_POLICY] = average[ids]
+            if key in policy:
+                table.set_policy(row, np.asarray(policy[key]))
+        return table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = {key: row for row, key in enumerate(self.keys)}
@@ -0,0 +1,271 @@
+import multiprocessing
+import random
+
+import numpy as np
+
+from CFR.agents.cfr_agent import CFRAgent
+from CFR.agents.infoset_table import CompactInfosetTable
+from CFR.agents.shared_infoset_table import SharedInfosetTable
+from CFR.envs.guandan import INFOSET_KEY_SIZE
+
+
+def _worker_loop(conn, seed, compact):
+    ''' Run sampled traversals for the coordinator until it sends None
+
+    Every message is a tuple (iteration, num_traversals, policy) where policy
+    holds the rows of the snapshot policy that changed since the previous
+    message, as returned by snapshot_policy of the table. The worker answers
+    with a tuple (deltas, steps): the sparse deltas of the regrets and
+    average policy it accumulated, and the number of env steps its
+    traversals took.
+
+    Args:
+        conn (Connection): The worker end of the pipe
+        seed (int): The seed of the worker
+        compact (boolean): True to use the compact infoset table
+    '''
+    import CFR
+
+    np.random.seed(seed)
+    random.seed(seed)
+    env = CFR.make('guandan', config={'allow_step_back': True, 'seed': seed, 'reuse_obs': True})
+    # The policy of the local table is the snapshot of the coordinator and
+    # its regrets and average policy only hold the deltas of one message
+    agent = CFRAgent(env, compact=compact)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        iteration, num_traversals, policy = message
+        agent.table.set_policy_snapshot(policy)
+        agent.iteration = iteration
+        timestep = env.timestep
+        for _ in range(num_traversals):
+            agent.sample_traversals()
+        conn.send((agent.table.take_deltas(), env.timestep - timestep))
+    conn.close()
+
+
+def _shared_worker_loop(conn, seed, handle):
+    ''' Run sampled traversals on a shared table until the coordinator sends None
+
+    Every message is a tuple (iteration, num_traversals). The worker answers
+    with a tuple (touched, steps, error): the rows it touched, whose policy
+    the coordinator then recomputes, the number of env steps its traversals
+    took, and None, or the exception that stopped its traversals, e.g. the
+    ValueError of a full table. The worker keeps
+    serving messages after an error, so the coordinator can stop it cleanly.
+
+    Args:
+        conn (Connection): The worker end of the pipe
+        seed (int): The seed of the worker
+        handle (tuple): The handle of the SharedInfosetTable
+    '''
+    import CFR
+
+    np.random.seed(seed)
+    random.seed(seed)
+    env = CFR.make('guandan', config={'allow_step_back': True, 'seed': seed, 'reuse_obs': True})
+    table = SharedInfosetTable.attach(handle)
+    agent = CFRAgent(env, table=table)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        agent.iteration, num_traversals = message
+        error = None
+        timestep = env.timestep
+        try:
+            for _ in range(num_traversals):
+                agent.sample_traversals()
+        except Exception as e:
+            error = e
+        conn.send((sorted(table.touched), env.timestep - timestep, error))
+        table.touched.clear()
+    table.close()
+    conn.close()
+
+
+class ParallelCFRTrainer(object):
+    ''' Train a CFRAgent with several worker processes
+
+    Each worker owns a GuandanEnv with its own seed and traverses sampled
+    games against a snapshot of the agent policy. The sparse regret and
+    average policy deltas of all workers are merged into the agent table,
+    then the policy of the merged rows is recomputed and broadcast to the
+    workers as the next snapshot. The env steps of the workers are added
+    to the timestep of the agent env, which does not step itself.
+    '''
+
+    def __init__(self, agent, num_workers, seed=None, traversals_per_worker=1):
+        ''' Start the workers
+
+        Args:
+            agent (CFRAgent): The agent whose table is trained
+            num_workers (int): The number of worker processes
+            seed (int): The seed of the first worker. Worker i uses seed + i
+            traversals_per_worker (int): The number of sampled traversals per
+                                         player each worker runs per iteration
+        '''
+        self.agent = agent
+        self.num_workers = num_workers
+        self.traversals_per_worker = traversals_per_worker
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_workers)
+        compact = isinstance(agent.table, CompactInfosetTable)
+
+        self.connections = []
+        self.processes = []
+        for i in range(num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker_loop, args=(child_conn, seed + i, compact))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+        # The first snapshot is the whole policy of the agent
+        self._snapshot_rows = list(range(len(agent.table)))
+
+    def train(self):
+        ''' Do one iteration of CFR in all the workers
+        '''
+        table = self.agent.table
+        self.agent.iteration += 1
+        # Compact tables send their rows sparse, not expanded to dense vectors
+        policy = table.snapshot_policy(self._snapshot_rows)
+        message = (self.agent.iteration, self.traversals_per_worker, policy)
+        for conn in self.connections:
+            conn.send(message)
+        for conn in self.connections:
+            deltas, steps = conn.recv()
+            table.merge_deltas(deltas)
+            # The env of the agent does not step, count the steps of the workers
+            self.agent.env.timestep += steps
+
+        # Only the merged rows have new regrets, so only their policy changes
+        self._snapshot_rows = sorted(table.touched)
+        table.update_policy(self._snapshot_rows)
+
+    def close(self):
+        ''' Stop the workers
+        '''
+        for conn in self.connections:
+            conn.send(None)
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class SharedMemoryCFRTrainer(object):
+    ''' Train a CFRAgent with worker processes sharing one infoset table
+
+    The agent table is moved into a SharedInfosetTable. The workers traverse
+    sampled games and accumulate regrets and average policy into it directly.
+    Between iterations the coordinator recomputes the policy of the touched
+    rows in place, while the workers wait. On close the agent gets a plain
+    InfosetTable copy back.
+
+    The shared table can not grow. When it fills up, the workers that need
+    a new row stop their traversals and report it, and train raises a
+    ValueError once every worker has answered. The trainer stays usable, so
+    close still hands the agent everything learned so far.
+    '''
+
+    def __init__(self, agent, num_workers, capacity, seed=None, traversals_per_worker=1,
+                 lock_policy='benign'):
+        ''' Create the shared table and start the workers
+
+        Args:
+            agent (CFRAgent): The agent whose table is trained
+            num_workers (int): The number of worker processes
+            capacity (int): The maximum number of infosets of the shared table
+            seed (int): The seed of the first worker. Worker i uses seed + i
+            traversals_per_worker (int): The number of sampled traversals per
+                                         player each worker runs per iteration
+            lock_policy (str): 'benign' or 'striped', see SharedInfosetTable
+        '''
+        self.agent = agent
+        self.traversals_per_worker = traversals_per_worker
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_workers)
+
+        old_table = agent.table
+        if len(old_table) > capacity:
+            raise ValueError('The agent has {} infosets, more than the shared table capacity {}'.format(
+                len(old_table), capacity))
+        table = SharedInfosetTable(agent.env.num_actions, INFOSET_KEY_SIZE, capacity,
+                                   lock_policy=lock_policy)
+        for row, key in enumerate(old_table.keys):
+            new_row = table.intern(key)
+            table.regrets[new_row] = old_table.dense('regrets', row)
+            table.average_policy[new_row] = old_table.dense('average_policy', row)
+            table.policy[new_row] = old_table.dense('policy', row)
+        # The rows keep their indexes, so the rows not saved yet carry over
+        table.touched = set(old_table.touched)
+        table.unsaved = set(getattr(old_table, 'unsaved', ()))
+        agent.table = table
+
+        self.connections = []
+        self.processes = []
+        for i in range(num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shared_worker_loop,
+                                              args=(child_conn, seed + i, table.handle()))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def train(self):
+        ''' Do one iteration of CFR in all the workers
+
+        Raises:
+            ValueError: If a worker stopped, e.g. because the shared table is
+                        full. The rows touched before are still updated
+        '''
+        self.agent.iteration += 1
+        for conn in self.connections:
+            conn.send((self.agent.iteration, self.traversals_per_worker))
+        touched = set()
+        errors = []
+        for i, conn in enumerate(self.connections):
+            rows, steps, error = conn.recv()
+            touched.update(rows)
+            self.agent.env.timestep += steps
+            if error is not None:
+                errors.append('worker {}: {}'.format(i, error))
+        self.agent.table.update_policy(sorted(touched))
+        if errors:
+            raise ValueError('Shared CFR iteration {} failed in {}'.format(
+                self.agent.iteration, '; '.join(errors)))
+
+    def close(self):
+        ''' Stop the workers and give the agent a plain copy of the table
+        '''
+        for conn in self.connections:
+            conn.send(None)
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+        table = self.agent.table
+        self.agent.table = table.to_table()
+        table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
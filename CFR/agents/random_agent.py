@@ -1,5 +1,7 @@
 import numpy as np
 
+from CFR.utils.utils import sample_masked
+
 
 class RandomAgent(object):
     ''' A random agent. Random agents is for running toy examples on the card games
@@ -13,9 +15,11 @@ class RandomAgent(object):
         '''
         self.use_raw = False
         self.num_actions = num_actions
+        # Weights and scratch buffer to sample with the legal mask of a state
+        self._weights = np.ones(num_actions)
+        self._sample_probs = np.empty(num_actions)
 
-    @staticmethod
-    def step(state):
+    def step(self, state):
         ''' Predict the action given the curent state in gerenerating training data.
 
         Args:
@@ -25,7 +29,11 @@ class RandomAgent(object):
             action (int): The action predicted (randomly chosen) by the random agent
         '''
         # print("random:",state['legal_actions'])
-        return np.random.choice(state['legal_actions'])
+        legal_mask = state.get('legal_mask')
+        if legal_mask is not None:
+            return sample_masked(self._weights, legal_mask, self._sample_probs)
+        legal_actions = state['legal_actions']
+        return legal_actions[np.random.randint(len(legal_actions))]
 
     def eval_step(self, state):
         ''' Predict the action given the current state for evaluation.
@@ -38,11 +46,9 @@ class RandomAgent(object):
             action (int): The action predicted (randomly chosen) by the random agent
             probs (list): The list of action probabilities
         '''
-        probs = [0 for _ in range(self.num_actions)]
-        for i in state['legal_actions']:
-            probs[i] = 1/len(state['legal_actions'])
+        prob = 1 / len(state['legal_actions'])
 
         info = {}
-        info['probs'] = {state['raw_legal_actions'][i]: probs[state['legal_actions'][i]] for i in range(len(state['legal_actions']))}
+        info['probs'] = {state['raw_legal_actions'][i]: prob for i in range(len(state['legal_actions']))}
 
         return self.step(state), info
@@ -0,0 +1,281 @@
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from CFR.agents.infoset_table import InfosetTable
+
+
+def _key_hash(key):
+    ''' A hash of an infoset key that is the same in every process
+    '''
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def _unpickle_table(table):
+    ''' Unpickle the plain copy stored for a SharedInfosetTable
+    '''
+    return table
+
+
+class _SharedKeys(object):
+    ''' A read-only sequence of the keys of a shared table
+    '''
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.size
+
+    def __getitem__(self, row):
+        if row >= self.table.size:
+            raise IndexError(row)
+        return self.table.key_bytes[row].tobytes()
+
+    def __iter__(self):
+        for row in range(self.table.size):
+            yield self.table.key_bytes[row].tobytes()
+
+
+class SharedInfosetTable(InfosetTable):
+    ''' An infoset table living in shared memory
+
+    Several traversal processes attach to the same table and accumulate
+    regrets and average policy into it directly, so no deltas have to be
+    serialized between them. The table has a fixed capacity and fixed-width
+    byte keys. Keys are found through an open-addressing hash index that is
+    also in shared memory.
+
+    Concurrency:
+        Adding a key is serialized by one lock, and lookups are lock-free.
+        A key is written before its slot in the hash index, so a reader that
+        finds the slot also sees the whole key. With lock_policy 'benign',
+        accumulate does no locking. '+=' on a float is a read-modify-write,
+        so two processes updating the same (row, action) at the same moment
+        can lose one update. Sampled traversals rarely touch the same row at
+        once, so such losses are rare and act like extra sampling noise, as
+        in Hogwild-style SGD. With lock_policy 'striped', accumulate holds the
+        lock of stripe row % num_stripes and no update is lost.
+    '''
+
+    def __init__(self, num_actions, key_size, capacity, lock_policy='benign', num_stripes=64,
+                 dtype=np.float64, _handle=None):
+        ''' Create a table, or attach to an existing one
+
+        Args:
+            num_actions (int): The size of the action space
+            key_size (int): The length in bytes of every infoset key
+            capacity (int): The maximum number of infosets
+            lock_policy (str): 'benign' or 'striped', see the class docstring
+            num_stripes (int): The number of locks used by the 'striped' policy
+            dtype (numpy.dtype): The dtype of the value arrays
+        '''
+        if lock_policy not in ('benign', 'striped'):
+            raise ValueError('Unknown lock policy: {}'.format(lock_policy))
+        self.num_actions = num_actions
+        self.key_size = key_size
+        self.capacity = capacity
+        self.lock_policy = lock_policy
+        self.dtype = np.dtype(dtype)
+        # A power of two with at least half of the slots free
+        self.num_slots = 1 << (2 * capacity - 1).bit_length()
+
+        if _handle is None:
+            nbytes = sum(self._layout())
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._owner = True
+            self._insert_lock = multiprocessing.Lock()
+            self._stripe_locks = [multiprocessing.Lock() for _ in range(num_stripes)] \
+                if lock_policy == 'striped' else []
+        else:
+            name, self._insert_lock, self._stripe_locks = _handle
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._map_arrays()
+        if _handle is None:
+            self._counter[0] = 0
+            self.slots[:] = 0
+            self.regrets[:] = 0
+            self.average_policy[:] = 0
+            self.policy[:] = 1.0 / num_actions
+
+        # Rows never move, so the rows found by this process can be cached
+        self.index = {}
+        self.touched = set()
+        self.unsaved = set()
+
+    def _layout(self):
+        ''' The sizes in bytes of the counter, slots, keys and value arrays
+        '''
+        values = self.capacity * self.num_actions * self.dtype.itemsize
+        return [8, self.num_slots * 8, self.capacity * self.key_size, values, values, values]
+
+    def _map_arrays(self):
+        ''' Create the NumPy views on the shared memory block
+        '''
+        sizes = self._layout()
+        offsets = np.cumsum([0] + sizes)
+        buf = self._shm.buf
+        self._counter = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offsets[0])
+        self.slots = np.ndarray((self.num_slots,), dtype=np.int64, buffer=buf, offset=offsets[1])
+        self.key_bytes = np.ndarray((self.capacity, self.key_size), dtype=np.uint8, buffer=buf,
+                                    offset=offsets[2])
+        shape = (self.capacity, self.num_actions)
+        self.regrets = np.ndarray(shape, dtype=self.dtype, buffer=buf, offset=offsets[3])
+        self.average_policy = np.ndarray(shape, dtype=self.dtype, buffer=buf, offset=offsets[4])
+        self.policy = np.ndarray(shape, dtype=self.dtype, buffer=buf, offset=offsets[5])
+
+    def handle(self):
+        ''' Get what another process needs to attach to the table
+
+        The handle holds multiprocessing locks, so it can only be passed to
+        a child process when the process is started.
+
+        Returns:
+            (tuple): The arguments of SharedInfosetTable.attach
+        '''
+        return (self.num_actions, self.key_size, self.capacity, self.lock_policy, self.dtype,
+                (self._shm.name, self._insert_lock, self._stripe_locks))
+
+    @classmethod
+    def attach(cls, handle):
+        ''' Attach to a table created by another process
+
+        Args:
+            handle (tuple): The handle returned by SharedInfosetTable.handle
+
+        Returns:
+            (SharedInfosetTable): The attached table
+        '''
+        num_actions, key_size, capacity, lock_policy, dtype, shared = handle
+        return cls(num_actions, key_size, capacity, lock_policy, dtype=dtype, _handle=shared)
+
+    @property
+    def size(self):
+        return int(self._counter[0])
+
+    @property
+    def keys(self):
+        return _SharedKeys(self)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return self.lookup(key) is not None
+
+    def _allocate(self, capacity):
+        raise ValueError('Shared infoset table is full, capacity {}. '
+                         'Create it with a larger capacity'.format(self.capacity))
+
+    def _probe(self, key):
+        ''' Find the slot of a key in the hash index
+
+        Returns:
+            (tuple): (slot, row). row is None if the key is not in the table
+                     and slot is then the free slot where it would go
+        '''
+        mask = self.num_slots - 1
+        slot = _key_hash(key) & mask
+        while True:
+            entry = int(self.slots[slot])
+            if entry == 0:
+                return slot, None
+            if self.key_bytes[entry - 1].tobytes() == key:
+                return slot, entry - 1
+            slot = (slot + 1) & mask
+
+    def lookup(self, key):
+        ''' Get the row index of an infoset
+
+        Args:
+            key (bytes): The infoset key
+
+        Returns:
+            (int): The row index, or None if the infoset has not been seen
+        '''
+        row = self.index.get(key)
+        if row is None:
+            row = self._probe(key)[1]
+            if row is not None:
+                self.index[key] = row
+        return row
+
+    def intern(self, key, legal_actions=None):
+        ''' Get the row index of an infoset, adding a new row if needed
+
+        Args:
+            key (bytes): The infoset key
+            legal_actions (list): Indices of legal actions. Unused
+
+        Returns:
+            (int): The row index
+        '''
+        row = self.lookup(key)
+        if row is not None:
+            return row
+        if len(key) != self.key_size:
+            raise ValueError('Infoset key must be {} bytes, got {}'.format(self.key_size, len(key)))
+        with self._insert_lock:
+            # Another process may have added the key since the lookup
+            slot, row = self._probe(key)
+            if row is None:
+                row = self.size
+                if row == self.capacity:
+                    self._allocate(self.capacity * 2)
+                self.key_bytes[row] = np.frombuffer(key, dtype=np.uint8)
+                self._counter[0] = row + 1
+                # Publish the slot last so that readers see a complete key
+                self.slots[slot] = row + 1
+        self.index[key] = row
+        return row
+
+    def accumulate(self, row, action, regret, average):
+        ''' Add to the regret and the cumulative probability of an action
+
+        Args:
+            row (int): The row index
+            action (int): The action id
+            regret (float): The regret to add
+            average (float): The probability mass to add to the average policy
+        '''
+        if self._stripe_locks:
+            with self._stripe_locks[row % len(self._stripe_locks)]:
+                InfosetTable.accumulate(self, row, action, regret, average)
+        else:
+            InfosetTable.accumulate(self, row, action, regret, average)
+
+    def to_table(self):
+        ''' Copy the used rows into a plain InfosetTable
+
+        The rows keep their indexes, and the copy keeps the touched and
+        unsaved rows, so the next incremental save still writes them.
+
+        Returns:
+            (InfosetTable): The copy
+        '''
+        table = InfosetTable(self.num_actions, capacity=max(self.size, 1), dtype=self.dtype)
+        for key in self.keys:
+            table.intern(key)
+        table.regrets[:self.size] = self.regrets[:self.size]
+        table.average_policy[:self.size] = self.average_policy[:self.size]
+        table.policy[:self.size] = self.policy[:self.size]
+        table.touched = set(self.touched)
+        table.unsaved = set(self.unsaved)
+        return table
+
+    def __reduce__(self):
+        # Pickling, e.g. by CFRAgent.save, stores a plain copy of the table.
+        # Use handle and attach to share the table with another process
+        return _unpickle_table, (self.to_table(),)
+
+    def close(self):
+        ''' Detach from the shared memory, and free it if this process created it
+        '''
+        for name in ('_counter', 'slots', 'key_bytes', 'regrets', 'average_policy', 'policy'):
+            setattr(self, name, None)
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
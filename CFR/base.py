@@ -1,39 +1,88 @@
 ''' Game-related base classes
 '''
-class Card:
+class Card(object):
     '''
     Card stores the suit and rank of a single card
 
+    Cards are interned: Card(suit, rank) always returns the same immutable
+    object for the same suit and rank, so there are only 54 of them. Each one
+    carries its suit_index, rank_index and code, an int that identifies it,
+    and equality and hashing only look at the code.
+
     Note:
         The suit variable in a standard card game should be one of [S, H, D, C, BJ, RJ] meaning [Spades, Hearts, Diamonds, Clubs, Black Joker, Red Joker]
-        Similarly the rank variable should be one of [A, 2, 3, 4, 5, 6, 7, 8, 9, T, J, Q, K]
+        Similarly the rank variable should be one of [2, 3, 4, 5, 6, 7, 8, 9, T, J, Q, K, A], and '' for the jokers
     '''
-    suit = None
-    rank = None
+    __slots__ = ('suit', 'rank', 'suit_index', 'rank_index', 'code')
+
     valid_suit = ['S', 'H', 'D', 'C', 'BJ', 'RJ']
-    valid_rank = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K','A']
+    valid_rank = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 
-    def __init__(self, suit, rank):
-        ''' Initialize the suit and rank of a card
+    # (suit, rank) -> Card
+    _interned = {}
+
+    def __new__(cls, suit, rank):
+        ''' Get the card of a suit and rank
 
         Args:
             suit: string, suit of the card, should be one of valid_suit
-            rank: string, rank of the card, should be one of valid_rank
+            rank: string, rank of the card, should be one of valid_rank,
+                  or '' for the jokers
+
+        Returns:
+            (Card): The interned card
         '''
-        self.suit = suit
-        self.rank = rank
+        card = cls._interned.get((suit, rank))
+        if card is not None:
+            return card
+        if suit not in cls.valid_suit or (rank not in cls.valid_rank and rank != ''):
+            raise ValueError('Invalid card: suit {}, rank {}'.format(suit, rank))
+        suit_index = cls.valid_suit.index(suit)
+        if suit_index < 4:
+            if rank == '':
+                raise ValueError('Invalid card: suit {} needs a rank'.format(suit))
+            rank_index = cls.valid_rank.index(rank)
+            # 0 - 51 for the standard cards, 52 and 53 for the jokers
+            code = 13 * suit_index + rank_index
+        else:
+            if rank != '':
+                raise ValueError('Invalid card: joker {} has no rank'.format(suit))
+            rank_index = -1
+            code = 48 + suit_index
+        card = object.__new__(cls)
+        for name, value in (('suit', suit), ('rank', rank), ('suit_index', suit_index),
+                            ('rank_index', rank_index), ('code', code)):
+            object.__setattr__(card, name, value)
+        cls._interned[(suit, rank)] = card
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Card is immutable')
+
+    def __reduce__(self):
+        # Unpickle to the interned card
+        return (Card, (self.suit, self.rank))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, Card):
-            return self.rank == other.rank and self.suit == other.suit
+            return self.code == other.code
         else:
             # don't attempt to compare against unrelated types
             return NotImplemented
 
     def __hash__(self):
-        suit_index = Card.valid_suit.index(self.suit)
-        rank_index = Card.valid_rank.index(self.rank)
-        return rank_index + 100 * suit_index
+        return self.code
+
+    def __repr__(self):
+        return 'Card({!r}, {!r})'.format(self.suit, self.rank)
 
     def __str__(self):
         ''' Get string representation of a card.
@@ -50,3 +99,8 @@ class Card:
             string: the combination of suit and rank of a card. Eg: 1S, 2H, AD, BJ, RJ...
         '''
         return self.suit+self.rank
+
+
+# All the cards, in the order of their codes
+CARDS = tuple([Card(suit, rank) for suit in Card.valid_suit[:4] for rank in Card.valid_rank]
+              + [Card('BJ', ''), Card('RJ', '')])
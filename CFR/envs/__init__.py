@@ -2,6 +2,7 @@
 '''
 from CFR.envs.env import Env
 from CFR.envs.registration import register, make
+from CFR.envs.vector_guandan import VectorGuandanEnv
 
 register(
     env_id='guandan',
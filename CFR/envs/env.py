@@ -15,6 +15,11 @@ class Env(object):
                 'seed' (int) - A environment local random seed.
                 'allow_step_back' (boolean) - True if allowing
                  step_back.
+                'reuse_obs' (boolean) - True to encode every observation
+                 into the same read-only buffer, which is overwritten by
+                 the next state. Only for agents that do not keep obs.
+                'legal_mask' (boolean) - True to add a read-only boolean
+                 mask of the legal actions to every state, 'legal_mask'.
                 There can be some game specific configurations, e.g., the
                 number of players in the game. These fields should start with
                 'game_', e.g., 'game_num_players' which specify the number of
@@ -26,6 +31,11 @@ class Env(object):
         '''
         self.allow_step_back = self.game.allow_step_back = config['allow_step_back']
         self.action_recorder = []
+        self.reuse_obs = config['reuse_obs']
+        self.use_legal_mask = config['legal_mask']
+        # The last extracted state, returned again while the game state is the same
+        self._raw_state = None
+        self._state = None
 
         # Game specific configurations
         # Currently only support blackjack、limit-holdem、no-limit-holdem
@@ -60,7 +70,7 @@ class Env(object):
         '''
         state, player_id = self.game.init_game()
         self.action_recorder = []
-        return self._extract_state(state), player_id
+        return self._extract_cached(state), player_id
 
     def step(self, action, raw_action=False):
         ''' Step forward
@@ -83,7 +93,7 @@ class Env(object):
         self.action_recorder.append((self.get_player_id(), action))
         next_state, player_id = self.game.step(action)
 
-        return self._extract_state(next_state), player_id
+        return self._extract_cached(next_state), player_id
 
     def step_back(self):
         ''' Take one step backward.
@@ -195,7 +205,22 @@ class Env(object):
         Returns:
             (numpy.array): The observed state of the player
         '''
-        return self._extract_state(self.game.get_state(player_id))
+        return self._extract_cached(self.game.get_state(player_id))
+
+    def _extract_cached(self, raw_state):
+        ''' Extract a state of the game, reusing the last extracted state if
+        the game returns the same state object again
+
+        Args:
+            raw_state (dict): The state of the game
+
+        Returns:
+            (dict): The extracted state
+        '''
+        if raw_state is not self._raw_state:
+            self._state = self._extract_state(raw_state)
+            self._raw_state = raw_state
+        return self._state
 
     def get_payoffs(self):
         ''' Get the payoffs of players. Must be implemented in the child class.
@@ -1,11 +1,153 @@
+import functools
+from collections.abc import MutableMapping
+
 import numpy as np
 
 from CFR.envs import Env
+from CFR.games.guandan.utils import SPECIFIC_MAP, SPECIFIC_ACTION_IDS, encode_cards_into
 
 DEFAULT_GAME_CONFIG = {
     'game_num_players': 4
 }
 
+# 信息集键: 当前手牌和其他玩家手牌中出现的牌面值, 各 15 位
+INFOSET_KEY_WEIGHTS = 1 << np.arange(30, dtype=np.int64)
+# 信息集键转为字节串时的长度
+INFOSET_KEY_SIZE = 8
+# 环境返回的状态的字段, 另外还有 legal_mask
+EXTRACTED_KEYS = ('obs', 'legal_actions', 'infoset_key', 'raw_obs', 'raw_legal_actions', 'action_record')
+
+
+@functools.lru_cache(maxsize=4096)
+def _translate_legal_actions(legal_actions):
+    ''' Translate the legal actions of a state to abstract action ids
+
+    The same legal actions come back again and again in rollouts, so the
+    result is cached, keyed by the tuple of legal actions.
+
+    Args:
+        legal_actions (tuple): The legal actions, in the order of the game state
+
+    Returns:
+        (tuple): Tuple containing:
+
+            (tuple): The ids of the legal abstract actions, in order of first use
+            (dict): id of an abstract action with kicker -> list of tuples
+                    (legal action, kicker) in the order of the legal actions
+    '''
+    legal_action_id = []
+    seen = set()
+    kicker_actions = {}
+    for action in legal_actions:
+        action_ids = SPECIFIC_ACTION_IDS.get(action)
+        if action_ids is None:
+            continue
+        abstracts = list(zip(SPECIFIC_MAP[action], action_ids))
+        for abstract, action_id in abstracts:
+            if action_id not in seen:
+                seen.add(action_id)
+                legal_action_id.append(action_id)
+        # with kicker
+        matched = set()
+        for abstract, action_id in abstracts:
+            if '*' in abstract and action_id not in matched:
+                matched.add(action_id)
+                main = abstract.strip('*')
+                kicker_actions.setdefault(action_id, []).append((action, action.replace(main, '', 1)))
+    return tuple(legal_action_id), kicker_actions
+
+
+@functools.lru_cache(maxsize=4096)
+def _legal_action_mask(legal_actions, num_actions):
+    ''' Get the mask of the legal abstract actions of a state
+
+    Args:
+        legal_actions (tuple): The legal actions, in the order of the game state
+        num_actions (int): The size of the action space
+
+    Returns:
+        (numpy.array): A read-only boolean array, True for the legal action ids.
+            It is shared by all the states with the same legal actions
+    '''
+    mask = np.zeros(num_actions, dtype=bool)
+    mask[list(_translate_legal_actions(legal_actions)[0])] = True
+    mask.flags.writeable = False
+    return mask
+
+
+class GuandanExtractedState(MutableMapping):
+    ''' The state returned by GuandanEnv, read like a dict
+
+    obs and infoset_key are encoded together, and legal_actions,
+    legal_mask and raw_legal_actions are translated, the first time one of
+    them is read. The legal actions are those of the game state that was
+    current when the state was extracted, as before. With the reuse_obs
+    config, obs is encoded into the shared buffer of the env when it is
+    first read, and the next state whose obs is read overwrites it.
+    '''
+    __slots__ = ('_env', '_legal_state', '_values')
+
+    def __init__(self, env, state, legal_state):
+        '''
+        Args:
+            env (GuandanEnv): The env
+            state (GuandanState): The state of the game
+            legal_state (GuandanState): The current state of the game, whose
+                legal actions are used
+        '''
+        self._env = env
+        self._legal_state = legal_state
+        self._values = {'raw_obs': state, 'action_record': env.action_recorder}
+
+    def _keys(self):
+        if self._env.use_legal_mask:
+            return EXTRACTED_KEYS + ('legal_mask',)
+        return EXTRACTED_KEYS
+
+    def __getitem__(self, key):
+        values = self._values
+        if key in values:
+            return values[key]
+        env = self._env
+        if key == 'obs' or key == 'infoset_key':
+            state = values['raw_obs']
+            if env.reuse_obs:
+                obs = env.encode_obs(state)
+            else:
+                obs = env.encode_obs(state, np.empty(env.obs_shape, dtype=int))
+            values['obs'] = obs
+            values['infoset_key'] = env.get_infoset_key(obs)
+            return values[key]
+        if key == 'legal_actions':
+            value = env._get_legal_actions(self._legal_state['legal_actions'])
+        elif key == 'legal_mask' and env.use_legal_mask:
+            value = _legal_action_mask(tuple(self._legal_state['legal_actions'] or ()), env.num_actions)
+        elif key == 'raw_legal_actions':
+            # TODO: state['actions'] can be None, may have bugs
+            legal_actions = values['raw_obs']['legal_actions']
+            # game.get_state builds a new list for every state, no need to copy it
+            value = [] if legal_actions is None else legal_actions
+        else:
+            raise KeyError(key)
+        values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._values[key]
+
+    def __iter__(self):
+        keys = self._keys()
+        return iter(keys + tuple(key for key in self._values if key not in keys))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 
 class GuandanEnv(Env):
     '''  Environment
@@ -33,44 +175,76 @@ class GuandanEnv(Env):
         # self.state_shape = [7, 5, 15]
         # 减小状态假设空间，加快收敛速度
         self.state_shape = [2, 9, 15]
+        # 观测的形状: 当前手牌和其他玩家的手牌, 各 2*15
+        self.obs_shape = (2, 2, 15)
+        # 复用的观测缓冲区
+        self._obs_buffer = np.zeros(self.obs_shape, dtype=int)
+        self._obs_view = self._obs_buffer.view()
+        self._obs_view.flags.writeable = False
 
     def _extract_state(self, state):
         ''' Encode state
 
+        Nothing is encoded here: the returned GuandanExtractedState encodes
+        obs, and translates the legal actions, when they are first read, so
+        a step whose state nobody reads costs nothing.
+
         Args:
             state (dict): dict of original state
 
         Returns:
-            numpy array: 6*5*15 array
-                         6 : current hand
-                             the union of the other two players' hand
-                             the recent three actions
-                             the union of all played cards
+            (GuandanExtractedState): The state, with
+                obs: 2*2*15 array of the current hand and the union of the
+                     other players' hands
+                legal_actions, infoset_key, legal_mask (with the legal_mask
+                config), raw_obs, raw_legal_actions and action_record
         '''
         # obs = np.zeros((7, 9, 15), dtype=int)
-        obs = np.zeros((2, 2, 15), dtype=int)
-        for index in range(2):
-            obs[index][0] = np.ones(15, dtype=int)
-        self._encode_cards(obs[0], state['current_hand'])
-        self._encode_cards(obs[1], state['others_hand'])
         # for i, action in enumerate(state['trace'][-4:]):
         #     if action[1] != 'pass':
         #         self._encode_cards(obs[5 - i], action[1])
         # print(state['played_cards'])
-        # print(state['played_cards'])
         # if state['played_cards'] != None:
         #     self._encode_cards(obs[6], state['played_cards'])
+        return GuandanExtractedState(self, state, self.game.state)
 
-        extracted_state = {'obs': obs, 'legal_actions': self._get_legal_actions()}
-        extracted_state['raw_obs'] = state
-        # TODO: state['actions'] can be None, may have bugs
-        if state['legal_actions'] == None:
-            extracted_state['raw_legal_actions'] = []
-        else:
-            extracted_state['raw_legal_actions'] = [a for a in state['legal_actions']]
+    def encode_obs(self, state, out=None):
+        ''' Encode the observation of a state without allocating
 
-        extracted_state['action_record'] = self.action_recorder
-        return extracted_state
+        Args:
+            state (dict): dict of original state
+            out (numpy array): 2*2*15 array to write into. If None, the
+                observation is written into a buffer of the env, which the
+                next call overwrites
+
+        Returns:
+            numpy array: out, or a read-only view of the buffer of the env
+        '''
+        if out is None:
+            encode_cards_into(self._obs_buffer[0], state['current_hand'])
+            encode_cards_into(self._obs_buffer[1], state['others_hand'])
+            return self._obs_view
+        encode_cards_into(out[0], state['current_hand'])
+        encode_cards_into(out[1], state['others_hand'])
+        return out
+
+    def get_infoset_key(self, obs):
+        ''' Get the compact key of the infoset of an observation
+
+        obs holds the ranks present in the current hand and in the hands of
+        the other players, so the 30 presence bits identify it exactly.
+
+        Args:
+            obs (numpy array or bytes): The observation, or its bytes as
+                given by obs.tobytes(), e.g. the keys of old models
+
+        Returns:
+            (int): The key, below 2 ** 30. int.to_bytes(INFOSET_KEY_SIZE,
+                'little') turns it into a fixed-width byte key
+        '''
+        if isinstance(obs, bytes):
+            obs = np.frombuffer(obs, dtype=int).reshape(self.obs_shape)
+        return int(obs[:, 1, :].ravel() @ INFOSET_KEY_WEIGHTS)
 
     # 获得收益
     def get_payoffs(self):
@@ -96,17 +270,9 @@ class GuandanEnv(Env):
             return abstract_action
         # with kicker
         legal_actions = self.game.state['legal_actions']
-        specific_actions = []
-        kickers = []
-        for legal_action in legal_actions:
-            if legal_action not in self._SPECIFIC_MAP:
-                continue
-            for abstract in self._SPECIFIC_MAP[legal_action]:
-                main = abstract.strip('*')
-                if abstract == abstract_action:
-                    specific_actions.append(legal_action)
-                    kickers.append(legal_action.replace(main, '', 1))
-                    break
+        kicker_actions = _translate_legal_actions(tuple(legal_actions))[1].get(action_id, [])
+        specific_actions = [action for action, _ in kicker_actions]
+        kickers = [kicker for _, kicker in kicker_actions]
         # choose kicker with minimum score
         player_id = self.game.get_player_id()
         kicker_scores = []
@@ -124,23 +290,21 @@ class GuandanEnv(Env):
                 min_index = index
         return specific_actions[min_index]
 
-    def _get_legal_actions(self):
+    def _get_legal_actions(self, legal_actions=None):
         ''' Get all legal actions for current state
 
+        Args:
+            legal_actions (list): The legal actions of the game to translate,
+                None for those of the current state
+
         Returns:
             legal_actions (list): a list of legal actions' id
         '''
-        legal_action_id = []
-        legal_actions = self.game.state['legal_actions']
-        if legal_actions:
-            for action in legal_actions:
-                if action not in self._SPECIFIC_MAP:
-                    continue
-                for abstract in self._SPECIFIC_MAP[action]:
-                    action_id = self._ACTION_SPACE[abstract]
-                    if action_id not in legal_action_id:
-                        legal_action_id.append(action_id)
-        return legal_action_id
+        if legal_actions is None:
+            legal_actions = self.game.state['legal_actions']
+        if not legal_actions:
+            return []
+        return list(_translate_legal_actions(tuple(legal_actions))[0])
 
     def get_perfect_information(self):
         ''' Get the perfect information of the current state
@@ -4,6 +4,8 @@ import importlib
 DEFAULT_CONFIG = {
         'allow_step_back': False,
         'seed': None,
+        'reuse_obs': False,
+        'legal_mask': False,
         }
 
 class EnvSpec(object):
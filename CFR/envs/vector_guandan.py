@@ -0,0 +1,101 @@
+import numpy as np
+
+from CFR.envs.registration import make
+
+
+class VectorGuandanEnv(object):
+    ''' Step many Guandan games in lockstep
+
+    Every call returns the states of all the games as stacked arrays, so an
+    agent can choose the actions of all the games with array operations:
+
+        obs, legal_mask, player_ids = env.reset()
+        # e.g. uniformly random legal actions
+        actions = np.argmax(np.random.random(legal_mask.shape) * legal_mask, axis=1)
+        obs, legal_mask, player_ids, payoffs, dones = env.step(actions)
+
+    A game that is over is reset at once, and the state returned for it is
+    the first state of the next game. Its payoffs are returned once, in the
+    step that finished it.
+    '''
+
+    def __init__(self, num_envs, config={}):
+        ''' Make the games
+
+        Args:
+            num_envs (int): The number of games K
+            config (dict): The config of every GuandanEnv. If it has a seed,
+                           game i uses seed + i
+        '''
+        self.num_envs = num_envs
+        self.envs = []
+        for i in range(num_envs):
+            env_config = dict(config)
+            env_config['reuse_obs'] = True
+            env_config['legal_mask'] = True
+            if env_config.get('seed') is not None:
+                env_config['seed'] += i
+            self.envs.append(make('guandan', env_config))
+        env = self.envs[0]
+        self.num_players = env.num_players
+        self.num_actions = env.num_actions
+
+        # Buffers returned by reset and step, overwritten by the next call
+        self.obs = np.zeros((num_envs,) + tuple(env.obs_shape), dtype=int)
+        self.legal_mask = np.zeros((num_envs, self.num_actions), dtype=bool)
+        self.player_ids = np.zeros(num_envs, dtype=np.int64)
+        self.payoffs = np.zeros((num_envs, self.num_players))
+        self.dones = np.zeros(num_envs, dtype=bool)
+        # The state dicts of the current players, for agents that need them
+        self.states = [None] * num_envs
+
+    def _set_state(self, i, state, player_id):
+        ''' Write the state of game i into the buffers
+        '''
+        self.obs[i] = state['obs']
+        self.legal_mask[i] = state['legal_mask']
+        self.player_ids[i] = player_id
+        self.states[i] = state
+
+    def reset(self):
+        ''' Start new games in all the envs
+
+        Returns:
+            (tuple): Tuple containing:
+
+                (numpy.array): K * 2 * 2 * 15 observations
+                (numpy.array): K * num_actions boolean mask of legal actions
+                (numpy.array): The ids of the K current players
+        '''
+        for i, env in enumerate(self.envs):
+            state, player_id = env.reset()
+            self._set_state(i, state, player_id)
+        return self.obs, self.legal_mask, self.player_ids
+
+    def step(self, actions):
+        ''' Play one action in every game
+
+        Args:
+            actions (numpy.array): The K action ids of the current players
+
+        Returns:
+            (tuple): Tuple containing:
+
+                (numpy.array): K * 2 * 2 * 15 observations
+                (numpy.array): K * num_actions boolean mask of legal actions
+                (numpy.array): The ids of the K current players
+                (numpy.array): K * num_players payoffs of the games that
+                               finished in this step, zeros for the others
+                (numpy.array): K booleans, True for the games that finished
+                               in this step and were reset
+        '''
+        self.payoffs[:] = 0
+        self.dones[:] = False
+        for i, env in enumerate(self.envs):
+            state, player_id = env.step(int(actions[i]))
+            if env.is_over():
+                self.payoffs[i] = env.get_payoffs()
+                self.dones[i] = True
+                state, player_id = env.reset()
+            self._set_state(i, state, player_id)
+        return self.obs, self.legal_mask, self.player_ids, self.payoffs, self.dones
@@ -2,5 +2,6 @@ from CFR.games.guandan.dealer import GuandanDealer as Dealer
 from CFR.games.guandan.judger import GuandanJudger as Judger
 from CFR.games.guandan.player import GuandanPlayer as Player
 from CFR.games.guandan.round import GuandanRound as Round
+from CFR.games.guandan.state import GuandanState as State
 from CFR.games.guandan.game import GuandanGame as Game
 
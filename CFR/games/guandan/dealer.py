@@ -1,7 +1,15 @@
-import functools
+import numpy as np
 
 from CFR.utils import init_guandan_deck
-from CFR.games.guandan.utils import cards2str
+from CFR.games.guandan.utils import cards2str, card_sort_key, CARD_RANK_STR_INDEX
+
+# 排好序的整副牌, 牌的编码就是它在整副牌中的下标
+CANONICAL_DECK = init_guandan_deck()
+CANONICAL_DECK.sort(key=card_sort_key)
+CANONICAL_DECK_STR = cards2str(CANONICAL_DECK)
+# 牌的编码 -> 牌面值
+CARD_CODE_RANK = np.array([CARD_RANK_STR_INDEX[card.rank or card.suit[0]] for card in CANONICAL_DECK],
+                          dtype=np.int8)
 
 
 class GuandanDealer(object):
@@ -16,30 +24,39 @@ class GuandanDealer(object):
             1. deck with 54*2 cards including black joker and red joker
         """
         self.np_random = np_random
-        self.deck = init_guandan_deck()
-        self.deck.sort(key=functools.cmp_to_key(round.sort_card))
+        self.deck = CANONICAL_DECK
+        self.deck_str = CANONICAL_DECK_STR
+        # 洗牌后的牌的编码
+        self.deck_codes = None
         self.round = round
 
     # 洗牌
     def shuffle(self):
         """
         Randomly shuffle the deck
+
+        Only the card codes are shuffled. The permutation is drawn like
+        shuffling the deck list would, so a seed deals the same cards.
         """
-        self.np_random.shuffle(self.deck)
+        self.deck_codes = self.np_random.permutation(len(self.deck))
 
     # 发牌
     def deal_cards(self, players):
         """
         Deal cards to players
+
+        Every hand is sorted by rank with a stable counting sort of the
+        ranks of its card codes, so the cards of one rank keep the order
+        they were dealt in.
         Args:
             players (list): list of Player objects
         """
         hand_num = (len(self.deck)) // len(players)
         for index, player in enumerate(players):
-            current_hand = self.deck[index * hand_num:(index + 1) * hand_num]
-            current_hand.sort(key=functools.cmp_to_key(self.round.sort_card))
-            player.set_current_hand(current_hand)
-            player.initial_hand = cards2str(player.current_hand)
+            codes = self.deck_codes[index * hand_num:(index + 1) * hand_num]
+            codes = codes[np.argsort(CARD_CODE_RANK[codes], kind='stable')]
+            player.set_current_hand([self.deck[code] for code in codes])
+            player.initial_hand = str(player.hand)
 
     # 初始化
     def init(self, players):
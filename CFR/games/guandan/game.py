@@ -1,11 +1,12 @@
-import functools
-from heapq import merge
+import itertools
+
 import numpy as np
 
-from CFR.games.guandan.utils import cards2str, CARD_RANK_STR
+from CFR.games.guandan.utils import CARD_RANK_STR
 from CFR.games.guandan import Player
 from CFR.games.guandan import Round
 from CFR.games.guandan import Judger
+from CFR.games.guandan import State
 
 
 class GuandanGame:
@@ -19,6 +20,13 @@ class GuandanGame:
         self.np_random = np.random.RandomState()
         self.num_players = 4
         self.winner_id = []
+        # 玩家和裁判在每一局之间复用
+        self.players = None
+        self.judger = None
+        # 每一步得到一个新的局面编号, 回退时恢复
+        self._positions = itertools.count()
+        self._position = None
+        self.state = None
 
     def configure(self, game_config):
         self.num_players = game_config['game_num_players']
@@ -35,27 +43,47 @@ class GuandanGame:
         self.winner_group = None
         self.winner_id = []
         self.history = []
+        # 每一步之前的状态和获胜玩家数量, 用于回退
+        self._recorded_steps = []
         # 当前两组玩家的参谋
         self.group_officer = ['2', '2']
 
         # initialize players
-        self.players = [Player(num, self.np_random)
-                        for num in range(self.num_players)]
+        # 复用上一局的玩家和裁判
+        reuse = self.players is not None and len(self.players) == self.num_players
+        if reuse:
+            for player in self.players:
+                player.reset(self.np_random)
+        else:
+            self.players = [Player(num, self.np_random)
+                            for num in range(self.num_players)]
 
         # 出过的牌
         # CARD_RANK_STR为所有牌面值
-        self.played_cards = [np.zeros((len(CARD_RANK_STR),), dtype=np.int)
-                             for _ in range(self.num_players)]
+        if reuse:
+            for played_cards in self.played_cards:
+                played_cards.fill(0)
+        else:
+            self.played_cards = [np.zeros((len(CARD_RANK_STR),), dtype=np.int)
+                                 for _ in range(self.num_players)]
         # 初始化第一局
         self.round = Round(self.np_random, self.played_cards, '2')
         self.round.initiate(self.players, self.winner_group, self.winner_id)
 
         # 初始化裁判
-        self.judger = Judger(self.players, self.np_random, '2')
+        if reuse:
+            self.judger.np_random = self.np_random
+            self.judger.reset(self.players, '2')
+        else:
+            self.judger = Judger(self.players, self.np_random, '2')
+
+        # 所有玩家手上剩余的牌的压缩表示
+        self.remaining_packed = sum(player.hand.packed for player in self.players)
 
         # get state of first player
         player_id = self.round.current_player
         # print(player_id)
+        self._position = next(self._positions)
         self.state = self.get_state(player_id)
 
         return self.state, player_id
@@ -70,9 +98,15 @@ class GuandanGame:
             int: next player's id
         """
 
+        # 记录当前状态
+        self._recorded_steps.append((self.state, len(self.winner_id), self._position))
+        self._position = next(self._positions)
+
         # perfrom action
         player = self.players[self.round.current_player]
+        packed = player.hand.packed
         self.round.proceed_round(player, action)
+        self.remaining_packed += player.hand.packed - packed
         # print(player.player_id, action)
         # print(cards2str(player.current_hand))
 
@@ -109,21 +143,22 @@ class GuandanGame:
             return False
 
         # 回退
+        state, num_winners, self._position = self._recorded_steps.pop()
         player_id, cards = self.round.step_back(self.players)
-        if player_id in self.winner_id:
-            self.winner_id.remove(player_id)
+        del self.winner_id[num_winners:]
 
-        # 找到当前玩家上一轮出的牌
-        if cards != 'pass':
-            self.players[player_id].played_cards = self.round.find_last_played_cards_in_trace(player_id)
-        self.players[player_id].play_back()
+        # 恢复当前玩家的手牌和上一轮出的牌
+        player = self.players[player_id]
+        packed = player.hand.packed
+        player.play_back()
+        self.remaining_packed += player.hand.packed - packed
 
         # 更新当前可以出的牌
         if cards != 'pass':
             self.judger.restore_playable_cards(player_id)
 
-        # 获取当前玩家的状态
-        self.state = self.get_state(self.round.current_player)
+        # 上一步之后没有修改过的状态
+        self.state = state
         return True
 
     # 获取当前玩家的状态
@@ -133,27 +168,24 @@ class GuandanGame:
         Args:
             player_id (int): player id
         Returns:
-            (dict): The state of the player
+            (GuandanState): The state of the player. Its fields are computed
+                when they are read, and the same object is returned until
+                the game moves. It stays valid after the game moves
         """
-        player = self.players[player_id]
-        # 其他玩家当前手上的牌
-        others_hands = self._get_others_current_hand(player)
-        # 当前所有玩家手上的牌的数量
-        num_cards_left = [len(self.players[i].current_hand) for i in range(self.num_players)]
-
-        # 如果当前小局结束
-        if self.is_over():
-            # 清空当前动作
-            actions = []
-        # 如果当前小局没有结束
-        else:
-            actions = list(
-                player.available_actions(self.round.officer, self.judger.count_heart_officer(player.current_hand),
-                                         self.round.greater_player, self.judger))
-
-        # 获得当前状态
-        state = player.get_state(self.round.public, others_hands, num_cards_left, actions)
-        return state
+        # 局面没有变化时复用当前状态
+        state = self.state
+        if state is not None and state.player_id == player_id and state.position == self._position:
+            return state
+        return State(self, self.players[player_id], self._position)
+
+    # 获得当前局面的编号
+    def get_position(self):
+        """
+        Return the id of the current position of the game
+        Returns:
+            int: An id that changes with every step, and comes back with step_back
+        """
+        return self._position
 
     # 获得所有动作的数量
     @staticmethod
@@ -203,15 +235,3 @@ class GuandanGame:
         elif len(self.winner_id) >= 3:
             return True
         return False
-
-    # 获取其他玩家当前手上的牌
-    def _get_others_current_hand(self, player):
-        other_players = []
-        for p in self.players:
-            if p.player_id != player.player_id:
-                other_players.append(p)
-
-        others_hand = []
-        for p in other_players:
-            others_hand = merge(others_hand, p.current_hand, key=functools.cmp_to_key(self.round.sort_card))
-        return cards2str(others_hand)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+''' Implement Guandan Hand class
+'''
+from CFR.base import CARDS
+from CFR.games.guandan.utils import CARD_RANK_STR_INDEX, RANK_FIELD_BITS, RANK_FIELD_MASK
+from CFR.games.guandan.utils import pack_target, packed_contains, packed2str
+
+# 花色顺序
+SUITS = ['S', 'H', 'D', 'C']
+# 牌 (花色 + 牌面值) -> 牌的种类, 2-A 每个牌面值 4 种花色, 之后是小王和大王
+CARD_KIND_INDEX = {suit + rank: 4 * CARD_RANK_STR_INDEX[rank] + i
+                   for rank in '23456789TJQKA' for i, suit in enumerate(SUITS)}
+CARD_KIND_INDEX['BJ'] = 52
+CARD_KIND_INDEX['RJ'] = 53
+# 每种牌的数量占 2 位
+KIND_FIELD_BITS = 2
+KIND_FIELD_MASK = (1 << KIND_FIELD_BITS) - 1
+
+
+# Card.code -> 一张牌的牌面值数量和种类数量的压缩表示
+RANK_UNIT_BY_CODE = [1 << (RANK_FIELD_BITS * CARD_RANK_STR_INDEX[card.rank or card.suit[0]])
+                     for card in CARDS]
+KIND_UNIT_BY_CODE = [1 << (KIND_FIELD_BITS * CARD_KIND_INDEX[card.suit + card.rank])
+                     for card in CARDS]
+
+
+class GuandanHand:
+    """
+    The cards in a hand as two ints
+
+    packed holds the count of each of the 15 ranks, see utils.pack_cards,
+    and kinds the count of each of the 54 kinds of cards, so that suits are
+    known too. Adding, removing and containment only do a few int operations
+    whatever the size of the hand.
+    """
+
+    __slots__ = ('packed', 'kinds', 'size', '_str')
+
+    def __init__(self, cards=()):
+        ''' Build a hand from Card objects
+
+        Args:
+            cards (list): list of Card objects
+        '''
+        self.packed = 0
+        self.kinds = 0
+        self.size = 0
+        self._str = ''
+        self.add_cards(cards)
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        # 字符串在手牌变化后才重新生成
+        if self._str is None:
+            self._str = packed2str(self.packed)
+        return self._str
+
+    def add_card(self, card):
+        ''' Add one Card to the hand
+        '''
+        self.packed += RANK_UNIT_BY_CODE[card.code]
+        self.kinds += KIND_UNIT_BY_CODE[card.code]
+        self.size += 1
+        self._str = None
+
+    def remove_card(self, card):
+        ''' Remove one Card from the hand. The card must be in the hand
+        '''
+        self.packed -= RANK_UNIT_BY_CODE[card.code]
+        self.kinds -= KIND_UNIT_BY_CODE[card.code]
+        self.size -= 1
+        self._str = None
+
+    def add_cards(self, cards):
+        ''' Add a list of Card objects to the hand
+        '''
+        for card in cards:
+            self.add_card(card)
+
+    def remove_cards(self, cards):
+        ''' Remove a list of Card objects from the hand
+        '''
+        for card in cards:
+            self.remove_card(card)
+
+    def contains(self, cards):
+        ''' Check if the hand contains the ranks of cards
+
+        Args:
+            cards (string or int): A string of cards, or packed rank counts
+
+        Returns:
+            boolean
+        '''
+        if isinstance(cards, str):
+            cards = pack_target(cards)
+        return packed_contains(self.packed, cards)
+
+    def count(self, rank):
+        ''' Get the number of cards of a rank
+
+        Args:
+            rank (str): The solo character of the rank. Eg: 'T', 'B'
+
+        Returns:
+            int: The number of cards
+        '''
+        return (self.packed >> (RANK_FIELD_BITS * CARD_RANK_STR_INDEX[rank])) & RANK_FIELD_MASK
+
+    def count_kind(self, suit, rank):
+        ''' Get the number of cards of a suit and rank
+
+        Args:
+            suit (str): The suit. Eg: 'H', 'BJ'
+            rank (str): The rank, '' for the jokers
+
+        Returns:
+            int: The number of cards
+        '''
+        return (self.kinds >> (KIND_FIELD_BITS * CARD_KIND_INDEX[suit + rank])) & KIND_FIELD_MASK
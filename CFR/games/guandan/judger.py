@@ -8,7 +8,7 @@ from bisect import bisect_left
 import functools
 
 from CFR.games.guandan.utils import CARD_RANK_STR, CARD_RANK_STR_INDEX
-from CFR.games.guandan.utils import cards2str, contains_cards
+from CFR.games.guandan.utils import pack_target, packed_contains
 
 
 class GuandanJudger:
@@ -19,18 +19,33 @@ class GuandanJudger:
         """
         Initilize the Judger class
         """
+        self.np_random = np_random
+        self.reset(players, officer)
+
+    def reset(self, players, officer):
+        """
+        Compute the playable cards of the hands of a new game
+        Args:
+            players (list): list of Player objects, with their hands dealt
+            officer (str): the rank of the officer
+        """
         # 4位玩家
         # 当前可以出的牌
         self.playable_cards = [set() for _ in range(4)]
-        # 已经出过的牌
-        self._recorded_removed_playable_cards = [[] for _ in range(4)]
+        # 每次出牌之前的可出牌型, 用于回退
+        self._recorded_playable_cards = [[] for _ in range(4)]
+        # 牌面值 -> 用到该牌面值的牌型
+        self._rank_index = [collections.defaultdict(set) for _ in range(4)]
         self.officer = officer
         for player in players:
             player_id = player.player_id
             # 玩家当前手上的牌
-            current_hand = cards2str(player.current_hand)
+            current_hand = str(player.hand)
             # 当前可以出的牌型
             self.playable_cards[player_id] = self.playable_cards_from_hand(current_hand, player.current_hand)
+            for cards in self.playable_cards[player_id]:
+                for rank in set(cards):
+                    self._rank_index[player_id][rank].add(cards)
 
     # 单张顺子
     def solo_chain(self, indexes_list, h_officer_num):
@@ -345,50 +360,44 @@ class GuandanJudger:
         """
         Recalculate all legal cards the player can play according to his
         current hand.
+
+        The playable cards of a hand are all contained in it, so after a play
+        only the ones using a rank of the played cards have to be checked
+        again. They are found through the rank index. The first play after
+        the deal checks every playable cards, since the cards computed from
+        the initial hand are not all contained in it.
+
+        The set of playable cards is replaced rather than changed in place,
+        so the states made before keep the playable cards they saw.
         Args:
             player (Player object): object of Player
-            init_flag (boolean): For the first time, set it True to accelerate
-              the preocess.
         Returns:
-            list: list of string of playable cards
+            set: set of string of playable cards
         """
-        removed_playable_cards = []
-
         player_id = player.player_id
         # 当前手上的牌
-        current_hand = cards2str(player.current_hand)
-        h_officer_num = self.count_heart_officer(player.current_hand)
-        missed = None
-        #
-        for single in player.singles:
-            if single not in current_hand:
-                missed = single
-                break
-
-        playable_cards = self.playable_cards[player_id].copy()
-        # print(playable_cards)
-        # 有没有的牌面值
-        if missed is not None:
-            position = player.singles.find(missed)
-            player.singles = player.singles[position + 1:]
-            for cards in playable_cards:
-                # 如果当前缺少某张牌或者当前没有对应牌型
-                if missed in cards or (
-                        not contains_cards(current_hand, cards, self.officer, h_officer_num, player.current_hand)):
-                    # 移除可出牌型
-                    removed_playable_cards.append(cards)
-                    self.playable_cards[player_id].remove(cards)
-        # 没有缺失的牌
+        current_hand = player.hand.packed
+        playable_cards = self.playable_cards[player_id]
+
+        # 发牌后第一次出牌，检查所有牌型
+        if not self._recorded_playable_cards[player_id]:
+            candidates = playable_cards
+        # 只检查用到出过的牌面值的牌型
         else:
-            for cards in playable_cards:
-                if not contains_cards(current_hand, cards, self.officer, h_officer_num, player.current_hand):
-                    # del self.playable_cards[player_id][cards]
-                    removed_playable_cards.append(cards)
-                    self.playable_cards[player_id].remove(cards)
+            rank_index = self._rank_index[player_id]
+            candidates = set()
+            for rank in set(player.played_cards):
+                candidates.update(rank_index[rank])
+            candidates &= playable_cards
         # 移除的可出牌型
-        self._recorded_removed_playable_cards[player_id].append(removed_playable_cards)
-        # print("2", self.playable_cards[player_id])
-        return self.playable_cards[player_id]
+        removed_playable_cards = [cards for cards in candidates
+                                  if not packed_contains(current_hand, pack_target(cards))]
+        # 可出牌型的集合不在原地修改, 已经生成的状态可以继续引用之前的集合
+        self._recorded_playable_cards[player_id].append(playable_cards)
+        if removed_playable_cards:
+            playable_cards = playable_cards.difference(removed_playable_cards)
+            self.playable_cards[player_id] = playable_cards
+        return playable_cards
 
     # 回退当前可出的牌型
     def restore_playable_cards(self, player_id):
@@ -397,10 +406,8 @@ class GuandanJudger:
         Args:
             player_id: The id of the player whose playable_cards need to be restored
         """
-        # 移除的可出牌型出栈
-        removed_playable_cards = self._recorded_removed_playable_cards[player_id].pop()
-        # 合并当前手上的牌和出的牌
-        self.playable_cards[player_id].update(removed_playable_cards)
+        # 出牌之前的可出牌型出栈
+        self.playable_cards[player_id] = self._recorded_playable_cards[player_id].pop()
 
     # 获取当前玩家可出的牌
     def get_playable_cards(self, player):
@@ -1,10 +1,9 @@
 # -*- coding: utf-8 -*-
 ''' Implement Guandan Player class
 '''
-import functools
-
-from CFR.games.guandan.utils import get_gt_cards,sort_card
-from CFR.games.guandan.utils import cards2str
+from CFR.games.guandan.utils import get_gt_cards
+from CFR.games.guandan.utils import CARD_SORT_KEY, card_sort_key, bisect_cards
+from CFR.games.guandan.hand import GuandanHand
 
 
 class GuandanPlayer:
@@ -26,17 +25,26 @@ class GuandanPlayer:
             当前玩家手上的牌
             3. _current_hand: The rest of the cards after playing some of them
         '''
-        self.np_random = np_random
         self.player_id = player_id
+        self.reset(np_random)
+
+    def reset(self, np_random):
+        ''' Clear the player for a new game
+
+        Args:
+            np_random (numpy.random.RandomState): The random generator of the game
+        '''
+        self.np_random = np_random
         self.initial_hand = None
         self._current_hand = []
+        # 当前手上的牌的压缩表示, 与 _current_hand 同步
+        self.hand = GuandanHand()
         self.played_cards = None
-        self.singles = '23456789TJQKABR'
         self.tribute_card = None
 
-        # record cards removed from self._current_hand for each play()
-        # and restore cards back to self._current_hand when play_back()
-        # 每一轮玩家出的牌
+        # record cards removed from self._current_hand and the previous
+        # played_cards for each play(), and restore them when play_back()
+        # 每一轮玩家出的牌和之前的历史动作
         self._recorded_played_cards = []
 
     # 当前手上的牌
@@ -46,14 +54,15 @@ class GuandanPlayer:
 
     def set_current_hand(self, value):
         self._current_hand = value
+        self.hand = GuandanHand(value)
 
     def get_state(self, public, others_hands, num_cards_left, actions):
         state = {}
         state['seen_cards'] = public['seen_cards']
-        state['trace'] = public['trace'].copy()
+        state['trace'] = list(public['trace'])
         state['played_cards'] = public['played_cards']
         state['self'] = self.player_id
-        state['current_hand'] = cards2str(self._current_hand)
+        state['current_hand'] = str(self.hand)
         state['others_hand'] = others_hands
         state['num_cards_left'] = num_cards_left
         state['legal_actions'] = actions
@@ -99,55 +108,42 @@ class GuandanPlayer:
         # 不出牌
         if action == 'pass':
             # 历史为空
-            self._recorded_played_cards.append([])
+            self._recorded_played_cards.append(([], self.played_cards))
             return greater_player
         # 出牌
         else:
             removed_cards = []
+            previous_played_cards = self.played_cards
             # 历史动作
             self.played_cards = action
             for play_card in action:
-                # 如果是大小王 B->BJ R->RJ
-                if play_card in trans:
-                    play_card = trans[play_card]
-                # 当前手上的牌
-                for _, remain_card in enumerate(self._current_hand):
-                    # 2-A
-                    if remain_card.rank != '':
-                        remain_card = remain_card.rank
-                    # 大小鬼
-                    else:
-                        remain_card = remain_card.suit
-                    # print(self.player_id, "current hand", cards2str(self._current_hand))
-                    # 移除当前出的牌
-                    if play_card == remain_card:
-                        removed_cards.append(self.current_hand[_])
-                        self._current_hand.remove(self._current_hand[_])
-                        # print(self.player_id, "current hand", cards2str(self._current_hand))
-                        break
+                # 当前手上该牌面值的第一张牌
+                key = CARD_SORT_KEY[trans.get(play_card, play_card)]
+                index = bisect_cards(self._current_hand, key, right=False)
+                # 移除当前出的牌
+                if index < len(self._current_hand) and card_sort_key(self._current_hand[index]) == key:
+                    removed_cards.append(self._current_hand.pop(index))
+            self.hand.remove_cards(removed_cards)
             # 记录当前轮出的牌
-            self._recorded_played_cards.append(removed_cards)
+            self._recorded_played_cards.append((removed_cards, previous_played_cards))
             return self
 
     # 悔牌
     def play_back(self):
         """
-        Restore recorded cards back to self._current_hand
+        Restore recorded cards back to self._current_hand, and the previous
+        played_cards
         """
         # 悔牌
-        removed_cards = self._recorded_played_cards.pop()
-        # 加入当前手上的牌
-        self._current_hand.extend(removed_cards)
-        # 对当前手上的牌排序
-        self._current_hand.sort(key=functools.cmp_to_key(sort_card))
+        removed_cards, self.played_cards = self._recorded_played_cards.pop()
+        # 按牌面值插回当前手上的牌, 排在同牌面值的牌之后
+        for card in removed_cards:
+            self._current_hand.insert(bisect_cards(self._current_hand, card_sort_key(card)), card)
+        self.hand.add_cards(removed_cards)
 
     # 当前手上大王的数量
     def count_RJ(self):
-        cnt = 0
-        for card in self._current_hand:
-            if card.suit == 'RJ':
-                cnt += 1
-        return cnt
+        return self.hand.count_kind('RJ', '')
 
     # 获取当前玩家进贡的牌
     def get_tribute_card(self, officer):
@@ -157,10 +153,12 @@ class GuandanPlayer:
         if greatest_card.rank == officer and greatest_card.suit == 'H':
             tribute_card = self._current_hand[-2]
             self._current_hand.remove(tribute_card)
+            self.hand.remove_card(tribute_card)
             return tribute_card
         else:
             tribute_card = self._current_hand[-1]
             self._current_hand.remove(tribute_card)
+            self.hand.remove_card(tribute_card)
             return tribute_card
 
     def set_tribute_card(self, card):
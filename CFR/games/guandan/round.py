@@ -2,18 +2,74 @@
 """ Implement Guandan Round class
 """
 
-import functools
 import numpy as np
 import random
 import sys
+from collections.abc import Sequence
 
-from CFR.games.guandan.utils import cards2str
+from CFR.games.guandan.utils import cards2str, card_sort_key, sort_card
 from CFR.games.guandan.utils import CARD_RANK, CARD_RANK_STR, CARD_RANK_STR_INDEX
 from CFR.games.base import Card
 from CFR.games.guandan import Dealer
 
 sys.setrecursionlimit(15000)
 
+
+class GuandanTrace(Sequence):
+    """ Immutable trace of (player_id, action) pairs
+
+    Pushing an action returns a new trace that shares this one as its
+    parent, so a state can keep the trace of its round without copying it.
+    The tuple of the actions is only built when the trace is read.
+    """
+    __slots__ = ('parent', 'last', '_len', '_items')
+
+    def __init__(self, parent=None, last=None):
+        self.parent = parent
+        self.last = last
+        self._len = 0 if parent is None else len(parent) + 1
+        self._items = None
+
+    def push(self, entry):
+        """ Return the trace with entry appended
+        """
+        return GuandanTrace(self, entry)
+
+    def _tuple(self):
+        if self._items is None:
+            items = []
+            node = self
+            # 从最后一个动作往前找到已经展开的部分
+            while node._len and node._items is None:
+                items.append(node.last)
+                node = node.parent
+            items.reverse()
+            self._items = (node._items or ()) + tuple(items)
+        return self._items
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if index == -1 and self._len:
+            return self.last
+        return self._tuple()[index]
+
+    def __iter__(self):
+        return iter(self._tuple())
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return self._tuple() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._tuple())
+
+    def __repr__(self):
+        return repr(list(self._tuple()))
+
+
 class GuandanRound:
     """ Round can call other Classes' functions to keep the game running
     """
@@ -22,11 +78,15 @@ class GuandanRound:
         self.np_random = np_random
         self.played_cards = played_cards
         self.officer = officer
-        self.trace = []
+        self.trace = GuandanTrace()
+        # 每个玩家出过的牌, 按玩家顺序拼接成公共出牌记录
+        self._played_cards_str = [''] * len(played_cards)
+        # 每一步之前的最大出牌玩家和出牌记录, 用于回退
+        self._recorded_public = []
 
         self.greater_player = None
         self.dealer = Dealer(self.np_random, self)
-        self.deck_str = cards2str(self.dealer.deck)
+        self.deck_str = self.dealer.deck_str
         self.seen_cards = ""
         self.winner_group = None
         self.winners = []
@@ -80,7 +140,8 @@ class GuandanRound:
             action(str): string of legal specific action
         """
         # 出牌记录
-        self.trace.append((self.current_player, action))
+        self.trace = self.trace.push((self.current_player, action))
+        self.public['trace'] = self.trace
         # 如果当前玩家出牌
         if action != 'pass':
             # 当前玩家出的牌
@@ -91,7 +152,10 @@ class GuandanRound:
                 if c == self.players[self.current_player].tribute_card:
                     self.seen_cards = self.seen_cards.replace(c, '')
                     self.public['seen_cards'] = self.seen_cards
-            self.public['played_cards'] = self.cards_ndarray_to_str(self.played_cards)
+            # 只更新当前玩家出过的牌
+            self._played_cards_str[self.current_player] = self.cards_ndarray_to_str(
+                self.played_cards[self.current_player:self.current_player + 1])
+            self.public['played_cards'] = ''.join(self._played_cards_str)
 
     # 进行一轮
     def proceed_round(self, player, action):
@@ -103,6 +167,9 @@ class GuandanRound:
         Returns:
             object of Player: player who played current biggest cards.
         """
+        # 记录出牌前的状态
+        self._recorded_public.append((self.greater_player, self._played_cards_str[self.current_player],
+                                      self.public['played_cards']))
         self.update_public(action)
         # 出牌
         self.greater_player = player.play(action, self.greater_player)
@@ -118,7 +185,9 @@ class GuandanRound:
             The last player id and the cards played
         """
         # 上一步玩家和出牌出栈
-        player_id, cards = self.trace.pop()
+        player_id, cards = self.trace.last
+        self.trace = self.trace.parent
+        self.public['trace'] = self.trace
         # 回到上一个玩家
         self.current_player = player_id
         # 如果上一个玩家出了牌
@@ -127,15 +196,9 @@ class GuandanRound:
                 # self.played_cards.remove(card)
                 # 出牌数量-1
                 self.played_cards[player_id][CARD_RANK_STR_INDEX[card]] -= 1
-            self.public['played_cards'] = self.cards_ndarray_to_str(self.played_cards)
-        # 找到上一个出牌的玩家
-        greater_player_id = self.find_last_greater_player_id_in_trace()
-        # 如果之前有玩家出牌
-        if greater_player_id is not None:
-            # 上一个出牌的玩家
-            self.greater_player = players[greater_player_id]
-        else:
-            self.greater_player = None
+        # 恢复上一个出牌的玩家和出牌记录
+        (self.greater_player, self._played_cards_str[player_id],
+         self.public['played_cards']) = self._recorded_public.pop()
         return player_id, cards
 
     # 找到出牌最大的玩家
@@ -144,11 +207,13 @@ class GuandanRound:
         Returns:
             The last greater_player's id in trace
         """
-        for i in range(len(self.trace) - 1, -1, -1):
-            _id, action = self.trace[i]
+        node = self.trace
+        while node:
+            _id, action = node.last
             # 找到最后一个出牌的玩家
             if action != 'pass':
                 return _id
+            node = node.parent
         return None
 
     # 找到玩家上一轮出的牌
@@ -158,10 +223,12 @@ class GuandanRound:
         Returns:
             The player_id's last played_cards in trace
         """
-        for i in range(len(self.trace) - 1, -1, -1):
-            _id, action = self.trace[i]
+        node = self.trace
+        while node:
+            _id, action = node.last
             if _id == player_id and action != 'pass':
                 return action
+            node = node.parent
         return None
 
     # 按照牌的大小排序
@@ -173,26 +240,7 @@ class GuandanRound:
             card_2 (object): object of card
             :param current_officer: 当前的参谋
         """
-        key = []
-        for card in [card_1, card_2]:
-            # print(card)
-            if card.rank == '':
-                key.append(CARD_RANK.index(card.suit))
-            else:
-                key.append(CARD_RANK.index(card.rank))
-
-        # #  如果card_1是参谋且card_2不是参谋和大小鬼
-        # if card_1.rank == self.officer and card_2.rank != self.officer and key[1] < 13:
-        #     return 1
-        # # 如果card_2是参谋且card_1不是参谋和大小鬼
-        # if card_2.rank == self.officer and card_1.rank != self.officer and key[0] < 13:
-        #     return -1
-
-        if key[0] > key[1]:
-            return 1
-        if key[0] < key[1]:
-            return -1
-        return 0
+        return sort_card(card_1, card_2)
 
     # 进贡
     def pay_tribute(self):
@@ -218,7 +266,7 @@ class GuandanRound:
 
                 self.tribute_cards = [tribute_player.get_tribute_card(self.officer)]
                 seen_cards = self.tribute_cards
-                seen_cards.sort(key=functools.cmp_to_key(self.sort_card))
+                seen_cards.sort(key=card_sort_key)
                 self.seen_cards = cards2str(seen_cards)
                 self.tribute_players = [tribute_player]
                 # 上游玩家还贡
@@ -236,7 +284,7 @@ class GuandanRound:
                 self.tribute_cards.append(tribute_players[0].get_tribute_card())
                 self.tribute_cards.append(tribute_players[1].get_tribute_card())
                 seen_cards = self.tribute_cards
-                seen_cards.sort(key=functools.cmp_to_key(self.sort_card))
+                seen_cards.sort(key=card_sort_key)
                 self.seen_cards = cards2str(seen_cards)
                 self.tribute_players = tribute_players
                 # 还贡
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" Implement Guandan State class
+"""
+from collections.abc import Mapping
+
+from CFR.games.guandan.utils import packed2str, get_gt_cards_packed
+
+
+class GuandanState(Mapping):
+    """ State of a player, read like the dict of Player.get_state
+
+    Everything the state needs is saved when it is made: the packed hands,
+    the trace, the cards to beat, or the set of playable cards, which the
+    judger never changes in place. The fields that cost something
+    (current_hand, others_hand, trace and legal_actions) are computed from
+    them on first access and cached, so a state can be read at any time,
+    also after the game has moved on.
+    """
+    __slots__ = ('player_id', 'position', '_packed', '_others_packed', '_trace',
+                 '_playable_cards', '_greater_cards', '_values')
+
+    KEYS = ('seen_cards', 'trace', 'played_cards', 'self', 'current_hand',
+            'others_hand', 'num_cards_left', 'legal_actions')
+
+    def __init__(self, game, player, position):
+        """
+        Args:
+            game (GuandanGame): The game
+            player (GuandanPlayer): The player of the state
+            position (int): The position of the game, see GuandanGame.get_position
+        """
+        self.player_id = player.player_id
+        self.position = position
+        self._packed = player.hand.packed
+        # 其他玩家当前手上的牌, 每个牌面值的数量不超过8, 压缩表示可以直接相减
+        self._others_packed = game.remaining_packed - player.hand.packed
+        public = game.round.public
+        self._trace = public['trace']
+
+        # 与 Player.available_actions 相同: 可以出任意牌型, 或者要大过最大的牌
+        self._playable_cards = None
+        self._greater_cards = None
+        greater_player = game.round.greater_player
+        if game.is_over():
+            # 如果当前小局结束, 清空当前动作
+            self._playable_cards = ()
+        elif (greater_player is None or greater_player.player_id == player.player_id
+              or len(greater_player.current_hand) == 0):
+            self._playable_cards = game.judger.get_playable_cards(player)
+        else:
+            self._greater_cards = greater_player.played_cards
+
+        self._values = {
+            'seen_cards': public['seen_cards'],
+            'played_cards': public['played_cards'],
+            'self': player.player_id,
+            # 当前所有玩家手上的牌的数量
+            'num_cards_left': [p.hand.size for p in game.players],
+        }
+
+    def __getitem__(self, key):
+        values = self._values
+        if key in values:
+            return values[key]
+        if key == 'current_hand':
+            value = packed2str(self._packed)
+        elif key == 'others_hand':
+            value = packed2str(self._others_packed)
+        elif key == 'trace':
+            value = list(self._trace)
+        elif key == 'legal_actions':
+            if self._greater_cards is None:
+                value = list(self._playable_cards)
+            else:
+                value = get_gt_cards_packed(self._packed, self._greater_cards)
+        else:
+            raise KeyError(key)
+        values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+''' Precompiled guandan game tables
+
+compile_tables turns the JSON tables in jsondata (specific_map,
+action_space, card_type and type_card), and the index of greater
+combinations built from them, into flat arrays in a directory with
+    meta.json: the sha1 of every JSON file the tables were compiled from,
+               and the dtype and length of every array
+    <name>.bin: the values of one array
+
+Combinations, abstract actions and card types are stored once, in the
+sorted fixed-width string arrays combos, actions and types, and referred
+to by their index everywhere else. Each table is stored as
+    <table>_keys: the index of every key, in the order of the JSON table
+    <table>_rows: the row of every combination, action or type, or -1
+and each table of lists CSR-style: an indptr array, and one flat array of
+the values of all the lists.
+
+load_tables memory-maps the arrays read-only, so the processes of a pool
+share their pages, and returns TableView mappings over them. A key is
+found by binary search in the sorted names, and its value is only decoded
+the first time it is looked up. The tables are compiled again with
+
+    python -m CFR.games.guandan.tables
+
+after changing the JSON files. Until then load_tables returns None and
+the JSON files are read instead.
+'''
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+JSON_TABLES = ('specific_map', 'action_space', 'card_type', 'type_card')
+# Bump when the layout of the arrays changes
+TABLES_VERSION = 2
+
+
+def load_json_tables(json_path):
+    ''' Read the JSON game tables
+
+    Args:
+        json_path (str): The jsondata directory
+
+    Returns:
+        (dict): name in JSON_TABLES -> OrderedDict
+    '''
+    tables = {}
+    for name in JSON_TABLES:
+        with open(os.path.join(json_path, name + '.json'), 'r') as file:
+            tables[name] = json.load(file, object_pairs_hook=OrderedDict)
+    return tables
+
+
+def _json_digests(json_path):
+    digests = {}
+    for name in JSON_TABLES:
+        with open(os.path.join(json_path, name + '.json'), 'rb') as file:
+            digests[name] = hashlib.sha1(file.read()).hexdigest()
+    return digests
+
+
+def _csr(lists, dtype):
+    ''' Flatten a list of lists into an indptr array and a values array
+    '''
+    indptr = np.zeros(len(lists) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(values) for values in lists])
+    values = np.array([value for values in lists for value in values], dtype=dtype)
+    return indptr, values
+
+
+def _invert(keys, size):
+    ''' Invert the keys array of a table: name index -> row, or -1
+    '''
+    rows = np.full(size, -1, dtype=np.int32)
+    rows[keys] = np.arange(len(keys), dtype=np.int32)
+    return rows
+
+
+def compile_tables(json_path, path):
+    ''' Compile the JSON game tables into arrays
+
+    Args:
+        json_path (str): The jsondata directory
+        path (str): The directory to write the arrays into
+    '''
+    from CFR.games.guandan.utils import _build_gt_cards_index
+
+    tables = load_json_tables(json_path)
+    specific_map = tables['specific_map']
+    action_space = tables['action_space']
+    card_type = tables['card_type']
+    type_card = tables['type_card']
+    gt_cards_index = _build_gt_cards_index(card_type, type_card)
+
+    # 排序之后可以直接在数组上二分查找
+    combos = set(specific_map) | set(card_type)
+    for groups in type_card.values():
+        for cards_list in groups.values():
+            combos.update(cards_list)
+    combos = sorted(combos, key=lambda cards: cards.encode('ascii'))
+    combo_ids = {cards: index for index, cards in enumerate(combos)}
+    actions = sorted(action_space, key=lambda action: action.encode('ascii'))
+    action_ids = {action: index for index, action in enumerate(actions)}
+    types = sorted(type_card, key=lambda name: name.encode('ascii'))
+    type_ids = {name: index for index, name in enumerate(types)}
+
+    # 比它大的牌的压缩表示, 超过 64 位的部分单独存放
+    targets = [0] * len(combos)
+    for gt_cards in gt_cards_index.values():
+        for cards, target in gt_cards:
+            targets[combo_ids[cards]] = target
+
+    arrays = {
+        'combos': np.array([cards.encode('ascii') for cards in combos]),
+        'combo_targets_low': np.array([target & (2 ** 64 - 1) for target in targets], dtype=np.uint64),
+        'combo_targets_high': np.array([target >> 64 for target in targets], dtype=np.uint64),
+        'actions': np.array([action.encode('ascii') for action in actions]),
+        'action_space_keys': np.array([action_ids[action] for action in action_space], dtype=np.int16),
+        'action_space_values': np.array(list(action_space.values()), dtype=np.int16),
+        'types': np.array([name.encode('ascii') for name in types]),
+        'specific_map_keys': np.array([combo_ids[cards] for cards in specific_map], dtype=np.int32),
+        'card_type_keys': np.array([combo_ids[cards] for cards in card_type], dtype=np.int32),
+        'type_card_keys': np.array([type_ids[name] for name in type_card], dtype=np.int16),
+    }
+    arrays['action_space_rows'] = _invert(arrays['action_space_keys'], len(actions))
+    arrays['specific_map_rows'] = _invert(arrays['specific_map_keys'], len(combos))
+    arrays['card_type_rows'] = _invert(arrays['card_type_keys'], len(combos))
+    arrays['type_card_rows'] = _invert(arrays['type_card_keys'], len(types))
+    arrays['specific_map_indptr'], arrays['specific_map_values'] = _csr(
+        [[action_ids[action] for action in actions] for actions in specific_map.values()], np.int16)
+    arrays['card_type_indptr'], arrays['card_type_types'] = _csr(
+        [[type_ids[name] for name, _ in pairs] for pairs in card_type.values()], np.int16)
+    arrays['card_type_weights'] = np.array(
+        [int(weight) for pairs in card_type.values() for _, weight in pairs], dtype=np.int16)
+    arrays['type_card_indptr'], arrays['type_card_weights'] = _csr(
+        [[int(weight) for weight in groups] for groups in type_card.values()], np.int16)
+    arrays['type_card_group_indptr'], arrays['type_card_combos'] = _csr(
+        [[combo_ids[cards] for cards in cards_list]
+         for groups in type_card.values() for cards_list in groups.values()], np.int32)
+    # 与 card_type_keys 的顺序相同
+    arrays['gt_cards_indptr'], arrays['gt_cards_combos'] = _csr(
+        [[combo_ids[cards] for cards, _ in gt_cards_index[cards]] for cards in card_type], np.int32)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    meta = {'version': TABLES_VERSION, 'sources': _json_digests(json_path), 'arrays': {}}
+    for name, array in arrays.items():
+        array.tofile(os.path.join(path, name + '.bin'))
+        meta['arrays'][name] = {'dtype': array.dtype.str, 'length': len(array)}
+    # meta.json 最后写入, 写到一半的表不会被读取
+    tmp_path = os.path.join(path, 'meta.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(meta, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+
+class TableView(Mapping):
+    ''' A read-only mapping over one compiled table
+
+    The arrays stay the only copy of the table. A key is found by binary
+    search in the sorted names, and its value is decoded from the arrays
+    the first time it is looked up, then cached, as is a key that is not in
+    the table. Iteration follows the order of the JSON table.
+    '''
+
+    def __init__(self, names, keys, rows, decode):
+        '''
+        Args:
+            names (numpy.array): The sorted fixed-width names of the keys
+            keys (numpy.array): The index in names of every key, in table order
+            rows (numpy.array): index in names -> row of the table, or -1
+            decode (callable): row -> value
+        '''
+        self._names = names
+        self._keys = keys
+        self._rows = rows
+        self._decode = decode
+        self._cache = {}
+
+    def _lookup(self, key):
+        ''' Get the value of a key, or None if it is not in the table
+        '''
+        value = self._cache.get(key, self)
+        if value is self:
+            # 不在表中的键也缓存, 值为 None
+            value = None
+            try:
+                name = key.encode('ascii')
+            except (AttributeError, UnicodeEncodeError):
+                name = None
+            if name is not None:
+                index = int(np.searchsorted(self._names, name))
+                if index < len(self._names) and self._names[index] == name and self._rows[index] >= 0:
+                    value = self._decode(int(self._rows[index]))
+            self._cache[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is None else value
+
+    def __iter__(self):
+        names = self._names
+        for index in self._keys:
+            yield names[index].decode('ascii')
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '{}({} keys)'.format(type(self).__name__, len(self))
+
+
+def load_tables(path, json_path):
+    ''' Load the compiled game tables
+
+    Args:
+        path (str): The directory written by compile_tables
+        json_path (str): The jsondata directory the tables were compiled from
+
+    Returns:
+        (dict): TableView mappings equal to the tables of load_json_tables,
+                'specific_action_ids', the abstract action ids of every
+                combination of specific_map, and 'gt_cards_index', the
+                combinations greater than every combination of card_type
+                with their packed targets. None if the tables are missing,
+                or were compiled from other JSON files
+    '''
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    if meta.get('version') != TABLES_VERSION or meta.get('sources') != _json_digests(json_path):
+        return None
+
+    arrays = {}
+    for name, info in meta['arrays'].items():
+        if info['length'] == 0:
+            arrays[name] = np.zeros(0, dtype=info['dtype'])
+        else:
+            arrays[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=info['dtype'],
+                                     mode='r', shape=(info['length'],))
+    combos, actions, types = arrays['combos'], arrays['actions'], arrays['types']
+
+    def csr_row(indptr, values, row):
+        # CSR 表中第 row 行的值
+        return values[indptr[row]:indptr[row + 1]].tolist()
+
+    def specific_map(row):
+        return [actions[index].decode('ascii') for index in
+                csr_row(arrays['specific_map_indptr'], arrays['specific_map_values'], row)]
+
+    def specific_action_ids(row):
+        values, action_rows = arrays['action_space_values'], arrays['action_space_rows']
+        return tuple(int(values[action_rows[index]]) for index in
+                     csr_row(arrays['specific_map_indptr'], arrays['specific_map_values'], row))
+
+    def action_space(row):
+        return int(arrays['action_space_values'][row])
+
+    def card_type(row):
+        indptr = arrays['card_type_indptr']
+        start, end = indptr[row], indptr[row + 1]
+        return [[types[index].decode('ascii'), str(weight)] for index, weight in
+                zip(arrays['card_type_types'][start:end].tolist(),
+                    arrays['card_type_weights'][start:end].tolist())]
+
+    def type_card(row):
+        indptr, group_indptr = arrays['type_card_indptr'], arrays['type_card_group_indptr']
+        groups = OrderedDict()
+        for group in range(indptr[row], indptr[row + 1]):
+            groups[str(arrays['type_card_weights'][group])] = [
+                combos[index].decode('ascii') for index in
+                csr_row(group_indptr, arrays['type_card_combos'], group)]
+        return groups
+
+    def gt_cards_index(row):
+        low, high = arrays['combo_targets_low'], arrays['combo_targets_high']
+        return tuple((combos[index].decode('ascii'), int(low[index]) | int(high[index]) << 64)
+                     for index in csr_row(arrays['gt_cards_indptr'], arrays['gt_cards_combos'], row))
+
+    def view(table, decode):
+        names = {'action_space': actions, 'type_card': types}.get(table, combos)
+        return TableView(names, arrays[table + '_keys'], arrays[table + '_rows'], decode)
+
+    return {'specific_map': view('specific_map', specific_map),
+            'specific_action_ids': view('specific_map', specific_action_ids),
+            'action_space': view('action_space', action_space),
+            'card_type': view('card_type', card_type),
+            'type_card': view('type_card', type_card),
+            'gt_cards_index': view('card_type', gt_cards_index)}
+
+
+if __name__ == '__main__':
+    import CFR
+
+    _json_path = os.path.join(CFR.__path__[0], 'jsondata')
+    compile_tables(_json_path, os.path.join(_json_path, 'tables'))
@@ -1,31 +1,42 @@
 import os
-import json
 from collections import OrderedDict
-import threading
-import collections
+import functools
+
+import numpy as np
 
 import CFR
+from CFR.base import CARDS
+from CFR.games.guandan.tables import load_tables, load_json_tables
 
 # Read required docs
 ROOT_PATH = CFR.__path__[0]
+JSON_PATH = os.path.join(ROOT_PATH, 'jsondata')
+# 预编译的表, 见 tables.py
+TABLES_PATH = os.path.join(JSON_PATH, 'tables')
+
+# 优先读取预编译的表, 没有编译或者已经过期时读取 json
+_TABLES = load_tables(TABLES_PATH, JSON_PATH)
+if _TABLES is None:
+    _TABLES = load_json_tables(JSON_PATH)
 
 # a map of action to abstract action
-with open(os.path.join(ROOT_PATH, 'jsondata/specific_map.json'), 'r') as file:
-    SPECIFIC_MAP = json.load(file, object_pairs_hook=OrderedDict)
+SPECIFIC_MAP = _TABLES['specific_map']
 
 # a map of abstract action to its index and a list of abstract action
-with open(os.path.join(ROOT_PATH, 'jsondata/action_space.json'), 'r') as file:
-    ACTION_SPACE = json.load(file, object_pairs_hook=OrderedDict)
-    ACTION_LIST = list(ACTION_SPACE.keys())
+ACTION_SPACE = _TABLES['action_space']
+ACTION_LIST = list(ACTION_SPACE.keys())
+
+# a map of action to the ids of its abstract actions
+SPECIFIC_ACTION_IDS = _TABLES.get('specific_action_ids')
+if SPECIFIC_ACTION_IDS is None:
+    SPECIFIC_ACTION_IDS = {action: tuple(ACTION_SPACE[abstract] for abstract in abstracts)
+                           for action, abstracts in SPECIFIC_MAP.items()}
 
 # a map of card to its type. Also return both dict and list to accelerate
-with open(os.path.join(ROOT_PATH, 'jsondata/card_type.json'), 'r') as file:
-    data = json.load(file, object_pairs_hook=OrderedDict)
-    CARD_TYPE = (data, list(data), set(data))
+CARD_TYPE = (_TABLES['card_type'], list(_TABLES['card_type']), set(_TABLES['card_type']))
 
 # a map of type to its cards
-with open(os.path.join(ROOT_PATH, 'jsondata/type_card.json'), 'r') as file:
-    TYPE_CARD = json.load(file, object_pairs_hook=OrderedDict)
+TYPE_CARD = _TABLES['type_card']
 
 # rank list of solo character of cards
 CARD_RANK_STR = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K',
@@ -33,6 +44,10 @@ CARD_RANK_STR = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K',
 CARD_RANK_STR_INDEX = {'2': 0, '3': 1, '4': 2, '5': 3, '6': 4, '7': 5,
                        '8': 6, '9': 7, 'T': 8, 'J': 9, 'Q': 10,
                        'K': 11, 'A': 12, 'B': 13, 'R': 14}
+# byte of solo character of cards -> rank index, to encode a string of cards at once
+CARD_RANK_BYTE_INDEX = np.zeros(256, dtype=np.intp)
+for _rank, _index in CARD_RANK_STR_INDEX.items():
+    CARD_RANK_BYTE_INDEX[ord(_rank)] = _index
 # rank list
 CARD_RANK = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K',
              'A', 'BJ', 'RJ']
@@ -152,12 +167,96 @@ def cards2str(cards):
     return response
 
 
-class LocalObjs(threading.local):
-    def __init__(self):
-        self.cached_candidate_cards = None
+# 手牌的压缩表示: 每个牌面值的数量占 RANK_FIELD_BITS 位, 15 个牌面值打包成一个整数
+# 每个字段的最高位是保护位, 一次减法即可判断包含关系
+RANK_FIELD_BITS = 5
+RANK_FIELD_MASK = (1 << (RANK_FIELD_BITS - 1)) - 1
+# 同花顺牌型以 '*' 开头, '*' 占最后一个字段, 手牌中没有这个字段的牌
+RANK_GUARD = sum(1 << (RANK_FIELD_BITS * i + RANK_FIELD_BITS - 1) for i in range(len(CARD_RANK_STR) + 1))
+RANK_UNIT = {rank: 1 << (RANK_FIELD_BITS * i) for rank, i in CARD_RANK_STR_INDEX.items()}
+RANK_UNIT['*'] = 1 << (RANK_FIELD_BITS * len(CARD_RANK_STR))
+
+
+@functools.lru_cache(maxsize=65536)
+def pack_cards(cards):
+    """
+    Pack the rank counts of cards into an int
+
+    Args:
+        cards (string): A string of cards. Eg: '33KKB'
+
+    Returns:
+        int: The count of rank i in bits [5i, 5i + 4)
+    """
+    packed = 0
+    for card in cards:
+        packed += RANK_UNIT[card]
+    return packed
+
+
+@functools.lru_cache(maxsize=65536)
+def pack_target(cards):
+    """
+    Pack the cards a hand must contain to play cards
+
+    Like the original run-by-run check of contains_cards, each rank needs as
+    many cards as its longest run in cards, so '22426' needs two 2s. For
+    cards sorted by rank this is the same as pack_cards.
+
+    Args:
+        cards (string): A string of cards. Eg: '33KKB'
+
+    Returns:
+        int: Packed rank counts, see pack_cards
+    """
+    packed = 0
+    start = 0
+    for index in range(1, len(cards) + 1):
+        if index == len(cards) or cards[index] != cards[start]:
+            unit = RANK_UNIT[cards[start]]
+            shift = unit.bit_length() - 1
+            count = index - start
+            if count > (packed >> shift) & RANK_FIELD_MASK:
+                packed += (count - ((packed >> shift) & RANK_FIELD_MASK)) * unit
+            start = index
+    return packed
+
+
+def packed_contains(candidate, target):
+    """
+    Check if the packed rank counts of candidate contain the ones of target.
+
+    The guard bit of a field stays set after the subtraction exactly when
+    the candidate has at least as many cards of that rank, and a field never
+    borrows from the next one since counts are at most 8.
+
+    Args:
+        candidate (int): Packed rank counts, see pack_cards
+        target (int): Packed rank counts, see pack_cards and pack_target
+
+    Returns:
+        boolean
+    """
+    return ((candidate | RANK_GUARD) - target) & RANK_GUARD == RANK_GUARD
+
+
+def packed2str(packed):
+    """
+    Get the string representation of packed rank counts
 
+    Args:
+        packed (int): Packed rank counts, see pack_cards
 
-_local_objs = LocalObjs()
+    Returns:
+        string: The cards sorted by rank
+    """
+    response = []
+    for rank in CARD_RANK_STR:
+        count = packed & RANK_FIELD_MASK
+        if count:
+            response.append(rank * count)
+        packed >>= RANK_FIELD_BITS
+    return ''.join(response)
 
 
 def contains_cards(candidate, target, officer, h_officer_num, cards_list):
@@ -171,45 +270,30 @@ def contains_cards(candidate, target, officer, h_officer_num, cards_list):
     Returns:
         boolean
     """
-    # In normal cases, most continuous calls of this function
-    #   will test different targets against the same candidate.
-    # So the cached counts of each card in candidate can speed up
-    #   the comparison for following tests if candidate keeps the same.
-    if not _local_objs.cached_candidate_cards or _local_objs.cached_candidate_cards != candidate:
-        _local_objs.cached_candidate_cards = candidate
-        cards_dict = collections.defaultdict(int)
-        # 当前所有牌
-        for card in candidate:
-            cards_dict[card] += 1
-        _local_objs.cached_candidate_cards_dict = cards_dict
-    cards_dict = _local_objs.cached_candidate_cards_dict
     # 如果目标牌型为空
     if target == '':
         return True
+    return packed_contains(pack_cards(candidate), pack_target(target))
 
-    curr_card = target[0]
-    # 第一张牌
-    # for i in range(len(target)):
-    #     if target[i] != officer:
-    #         curr_card = target[i]
-    #         break
-    curr_count = 0
-    for card in target:
-        # if card == officer:
-        #     h_officer_num -= 1
-        #     if h_officer_num < 0:
-        #         return False
-        #     continue
-        if card != curr_card:
-            if cards_dict[curr_card] < curr_count:
-                return False
-            curr_card = card
-            curr_count = 1
-        else:
-            curr_count += 1
-    if cards_dict[curr_card] < curr_count:
-        return False
-    return True
+
+# 对牌进行编码, 写入已有的平面
+def encode_cards_into(plane, cards):
+    """
+    Encode a string of cards into a plane at once, like encode_cards does
+    on a plane whose first row is ones and second row is zeros: the second
+    row marks the ranks in cards and the first row the other ranks.
+
+    Args:
+        plane (numpy.array): 2*15 array to write into
+        cards (str): str of cards, every character is the solo
+            representation of a card
+    """
+    plane[0] = 1
+    plane[1] = 0
+    if cards:
+        ranks = CARD_RANK_BYTE_INDEX[np.frombuffer(cards.encode('ascii'), dtype=np.uint8)]
+        plane[1, ranks] = 1
+        plane[0, ranks] = 0
 
 
 # 对牌进行编码
@@ -252,6 +336,64 @@ def encode_cards(plane, cards):
             plane[0][rank] = 0
 
 
+def _build_gt_cards_index(card_type_table, type_card_table):
+    """
+    Find the cards greater than each cards in card_type_table
+
+    Args:
+        card_type_table (dict): cards -> its types, see CARD_TYPE
+        type_card_table (dict): type -> its cards, see TYPE_CARD
+
+    Returns:
+        dict: cards -> tuple of (greater cards, packed target of them), in
+            the order get_gt_cards tries them
+    """
+    gt_cards_index = {}
+    for target_cards, target_types in card_type_table.items():
+        type_dict = {}
+        for card_type, weight in target_types:
+            if card_type not in type_dict:
+                type_dict[card_type] = int(weight)
+
+        # 如果上个玩家出四大天王，没有牌比它大
+        if 'rocket' in type_dict:
+            gt_cards_index[target_cards] = ()
+            continue
+
+        # 炸弹
+        type_dict['rocket'] = -1
+
+        for i in range(11, 4):
+            if i == 5:
+                if "straight_flush" not in type_dict:
+                    type_dict["straight_flush"] = -1
+                else:
+                    break
+            if "bomb_" + str(i) not in type_dict:
+                type_dict["bomb_" + str(i)] = -1
+            else:
+                break
+
+        gt_cards = []
+        seen = set()
+        for card_type, weight in type_dict.items():
+            candidate = type_card_table[card_type]
+            for can_weight, cards_list in candidate.items():
+                if int(can_weight) > weight:
+                    for cards in cards_list:
+                        if cards not in seen:
+                            seen.add(cards)
+                            gt_cards.append((cards, pack_target(cards)))
+        gt_cards_index[target_cards] = tuple(gt_cards)
+    return gt_cards_index
+
+
+# 牌 -> 比它大的牌, 预编译的表中已经有了
+GT_CARDS_INDEX = _TABLES.get('gt_cards_index')
+if GT_CARDS_INDEX is None:
+    GT_CARDS_INDEX = _build_gt_cards_index(CARD_TYPE[0], TYPE_CARD)
+
+
 # 获得比之前玩家出的牌更大的牌
 def get_gt_cards(player, greater_player, officer, h_officer_num):
     """
@@ -268,76 +410,89 @@ def get_gt_cards(player, greater_player, officer, h_officer_num):
     Note:
         1. return value contains 'pass'
     """
+    return get_gt_cards_packed(player.hand.packed, greater_player.played_cards,
+                               len(greater_player.current_hand) > 0)
+
+
+def get_gt_cards_packed(current_hand, played_cards, can_pass=True):
+    """
+    Provide the cards of a hand which are greater than played_cards
+
+    Args:
+        current_hand (int): packed rank counts of the hand, see pack_cards
+        played_cards (str): the cards to beat
+        can_pass (boolean): True to add 'pass'
+
+    Returns:
+        list: list of string of greater cards
+    """
     # add 'pass' to legal actions
     gt_cards = []
-    if len(greater_player.current_hand) > 0:
+    if can_pass:
         gt_cards = ['pass']
-    current_hand = cards2str(player.current_hand)
-    target_cards = greater_player.played_cards
-
-    target_types = CARD_TYPE[0][target_cards]
-    type_dict = {}
-    for card_type, weight in target_types:
-        if card_type not in type_dict:
-            type_dict[card_type] = weight
-
-    # 如果上个玩家出四大天王，没有牌比它大
-    if 'rocket' in type_dict:
-        return gt_cards
-
-    # 炸弹
-    type_dict['rocket'] = -1
-
-    for i in range(11, 4):
-        if i == 5:
-            if "straight_flush" not in type_dict:
-                type_dict["straight_flush"] = -1
-            else:
-                break
-        if "bomb_" + str(i) not in type_dict:
-            type_dict["bomb_" + str(i)] = -1
-        else:
-            break
-
-    for card_type, weight in type_dict.items():
-        candidate = TYPE_CARD[card_type]
-        for can_weight, cards_list in candidate.items():
-            if int(can_weight) > int(weight):
-                for cards in cards_list:
-                    if cards not in gt_cards and contains_cards(current_hand, cards, officer, h_officer_num,
-                                                                player.current_hand):
-                        # if self.contains_cards(current_hand, cards):
-                        gt_cards.append(cards)
+    gt_cards.extend(cards for cards, target in GT_CARDS_INDEX[played_cards]
+                    if packed_contains(current_hand, target))
     return gt_cards
 
 
+# 牌面值 -> 排序用的整数
+CARD_SORT_KEY = {rank: index for index, rank in enumerate(CARD_RANK)}
+# Card.code -> 排序用的整数
+CARD_CODE_SORT_KEY = [CARD_SORT_KEY[card.rank or card.suit] for card in CARDS]
+
+
+# 排序用的整数
+def card_sort_key(card):
+    """ Get the sort key of a Card object, to sort cards by rank
+
+    Args:
+        card (object): object of Card
+
+    Returns:
+        int: the index of the rank of the card in CARD_RANK
+    """
+    return CARD_CODE_SORT_KEY[card.code]
+
+
+# 在排好序的牌中查找位置
+def bisect_cards(cards, key, right=True):
+    """ Find where cards of a sort key go in cards sorted by rank
+
+    Args:
+        cards (list): list of Card objects sorted by rank
+        key (int): the sort key, see card_sort_key
+        right (boolean): True for the position after the cards of the same
+            rank, False for the position of the first of them
+
+    Returns:
+        int: the position
+    """
+    lo, hi = 0, len(cards)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_key = CARD_CODE_SORT_KEY[cards[mid].code]
+        if mid_key < key or (right and mid_key == key):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
 # 按照牌的大小排序
 def sort_card(card_1, card_2):
     """ Compare the rank of two cards of Card object
 
+    Prefer card_sort_key as the key of sort, it does not need cmp_to_key.
+
     Args:
         card_1 (object): object of Card
         card_2 (object): object of card
-        :param current_officer: 当前的参谋
     """
-    key = []
-    for card in [card_1, card_2]:
-        # print(card)
-        if card.rank == '':
-            key.append(CARD_RANK.index(card.suit))
-        else:
-            key.append(CARD_RANK.index(card.rank))
-
-    # #  如果card_1是参谋且card_2不是参谋和大小鬼
-    # if card_1.rank == self.officer and card_2.rank != self.officer and key[1] < 13:
-    #     return 1
-    # # 如果card_2是参谋且card_1不是参谋和大小鬼
-    # if card_2.rank == self.officer and card_1.rank != self.officer and key[0] < 13:
-    #     return -1
-
-    if key[0] > key[1]:
+    key_1 = card_sort_key(card_1)
+    key_2 = card_sort_key(card_2)
+    if key_1 > key_2:
         return 1
-    if key[0] < key[1]:
+    if key_1 < key_2:
         return -1
     return 0
 
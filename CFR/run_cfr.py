@@ -2,23 +2,18 @@
 '''
 import os
 import argparse
-import shutil
 # import tensorflow as tf
 from numba import jit
 
 import CFR
-from CFR.agents import CFRAgent, RandomAgent
-from CFR.utils import set_seed, tournament, Logger, plot_curve
-
-
-def ignore(path, content_list):
-    return [
-    ]
+from CFR.agents import CFRAgent, RandomAgent, ParallelCFRTrainer, SharedMemoryCFRTrainer
+from CFR.agents.checkpoint import CheckpointWriter
+from CFR.utils import set_seed, tournament, Logger, plot_curve, ParallelTournament
 
 
 def train(args):
     # Make environments, CFR only supports Leduc Holdem
-    env = CFR.make('guandan', config={'allow_step_back': True})
+    env = CFR.make('guandan', config={'allow_step_back': True, 'reuse_obs': True})
     eval_env = CFR.make('guandan', config={})
 
     # Seed numpy, torch, random
@@ -47,23 +42,63 @@ def train(args):
          RandomAgent(num_actions=env.num_actions)])
 
     # eval_env.set_agents(agents)
-    # Start training
-    with Logger(args.log_dir) as logger:
-        for episode in range(args.num_episodes):
-            agent.train()
-            print('\rIteration {}\n'.format(episode), end='')
-            # Evaluate the performance. Play with Random agents.
-            if episode % args.evaluate_every == 0:
-                agent.save()  # Save model
-                reward, win_rob = tournament(eval_env, args.num_eval_games)
-                logger.log_performance(episode, env.timestep, reward[0], win_rob[0])
-            if episode % 50 == 0:
-                if os.path.exists("res3"):
-                    shutil.rmtree("res3")
-                shutil.copytree(args.log_dir, "res3", ignore=ignore)
-
-        # Get the paths
-        csv_path, fig_path = logger.csv_path, logger.fig_path
+    # Train with worker processes if asked. With a shared capacity the
+    # workers share one table in shared memory instead of sending deltas
+    trainer = agent
+    if args.num_workers > 1 and args.shared_capacity > 0:
+        trainer = SharedMemoryCFRTrainer(agent, args.num_workers, args.shared_capacity, seed=args.seed)
+    elif args.num_workers > 1:
+        trainer = ParallelCFRTrainer(agent, args.num_workers, seed=args.seed)
+
+    # Checkpoints are written in the background and rotated
+    writer = CheckpointWriter(agent.model_path, keep=args.keep_checkpoints)
+
+    # Evaluate in worker processes against the saved checkpoints while
+    # training goes on
+    evaluator = None
+    pending = []
+    if args.num_eval_workers > 0:
+        evaluator = ParallelTournament(
+            {}, [agent.model_path, RandomAgent(num_actions=env.num_actions), agent.model_path,
+                 RandomAgent(num_actions=env.num_actions)], args.num_eval_workers, seed=args.seed)
+
+    # Start training. The workers and the shared table are released even
+    # if training stops with an error
+    try:
+        with Logger(args.log_dir) as logger:
+            def log_oldest_evaluation():
+                eval_episode, timestep, result = pending.pop(0)
+                reward, win_rob = result.get()
+                logger.log_performance(eval_episode, timestep, reward[0], win_rob[0])
+
+            for episode in range(args.num_episodes):
+                trainer.train()
+                print('\rIteration {}\n'.format(episode), end='')
+                # Evaluate the performance. Play with Random agents.
+                if episode % args.evaluate_every == 0:
+                    # The writer removes the versions beyond keep_checkpoints,
+                    # so the evaluations of the oldest ones must finish first
+                    while len(pending) >= args.keep_checkpoints:
+                        log_oldest_evaluation()
+                    agent.save(writer)  # Save model
+                    if evaluator is None:
+                        reward, win_rob = tournament(eval_env, args.num_eval_games)
+                        logger.log_performance(episode, env.timestep, reward[0], win_rob[0])
+                    else:
+                        pending.append((episode, env.timestep,
+                                        evaluator.run_async(args.num_eval_games, writer.submitted)))
+                # Log the finished evaluations in order
+                while pending and (pending[0][2].ready() or episode == args.num_episodes - 1):
+                    log_oldest_evaluation()
+
+            # Get the paths
+            csv_path, fig_path = logger.csv_path, logger.fig_path
+    finally:
+        if trainer is not agent:
+            trainer.close()
+        if evaluator is not None:
+            evaluator.close()
+        writer.close()
     # Plot the learning curve
     plot_curve(csv_path, fig_path, 'cfr')
 
@@ -76,6 +111,11 @@ def main():
     parser.add_argument('--num_eval_games', type=int, default=100)
     parser.add_argument('--evaluate_every', type=int, default=100)
     parser.add_argument('--log_dir', type=str, default='experiments/guandan_cfr_result6/')
+    parser.add_argument('--num_workers', type=int, default=1)
+    # The maximum number of infosets of the shared table, 0 to send deltas
+    parser.add_argument('--shared_capacity', type=int, default=0)
+    parser.add_argument('--keep_checkpoints', type=int, default=3)
+    parser.add_argument('--num_eval_workers', type=int, default=0)
 
     args = parser.parse_args()
 
@@ -1,3 +1,4 @@
 from CFR.utils.logger import Logger, plot_curve
 from CFR.utils import seeding
 from CFR.utils.utils import *
+from CFR.utils.parallel_tournament import ParallelTournament
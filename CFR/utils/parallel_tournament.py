@@ -0,0 +1,223 @@
+''' Evaluate agents with a pool of worker processes
+'''
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from CFR.utils.utils import tournament_totals
+
+# The env and agents of a worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(env_config, agents):
+    ''' Make the env of a worker process
+
+    Args:
+        env_config (dict): The config of the env
+        agents (list): The agents, or model directories of CFRAgents
+    '''
+    import CFR
+
+    _worker['env'] = CFR.make('guandan', config=env_config)
+    _worker['agents'] = agents
+    # checkpoint directory -> CFRAgent loaded from it
+    _worker['loaded'] = {}
+
+
+def _wait_for_checkpoint(path, timeout):
+    ''' Wait until a CheckpointWriter has written a version
+
+    Args:
+        path (str): The directory of the version
+        timeout (float): The number of seconds to wait
+    '''
+    from CFR.agents.checkpoint import resolve_checkpoint, VERSION_PREFIX
+
+    deadline = time.time() + timeout
+    name = os.path.basename(os.path.normpath(path))
+    while not os.path.exists(path):
+        # Versions are written in order, so a version missing while LATEST
+        # names it or a newer one was already removed by the writer
+        latest = os.path.basename(resolve_checkpoint(os.path.dirname(os.path.normpath(path))))
+        if latest.startswith(VERSION_PREFIX) and latest >= name and not os.path.exists(path):
+            raise ValueError('Checkpoint {} was removed before it was loaded, '
+                             'keep more checkpoints than pending evaluations'.format(path))
+        if time.time() > deadline:
+            raise ValueError('Checkpoint {} was not written in {} seconds'.format(path, timeout))
+        time.sleep(0.1)
+
+
+def _load_agent(model_path, checkpoint, timeout):
+    ''' Load a CFRAgent read-only in a worker process
+
+    Args:
+        model_path (str): The model directory of the agent
+        checkpoint (str): The version to load, None for the newest
+        timeout (float): The number of seconds to wait for the version
+
+    Returns:
+        (CFRAgent): The agent
+    '''
+    from CFR.agents.cfr_agent import CFRAgent
+    from CFR.agents.checkpoint import resolve_checkpoint
+
+    if checkpoint is None:
+        checkpoint = resolve_checkpoint(model_path)
+    else:
+        _wait_for_checkpoint(checkpoint, timeout)
+    loaded = _worker['loaded']
+    if checkpoint not in loaded:
+        # Only keep the agents of the newest checkpoint
+        loaded.clear()
+        agent = CFRAgent(_worker['env'], checkpoint)
+        agent.load(mmap=True)
+        loaded[checkpoint] = agent
+    return loaded[checkpoint]
+
+
+def _play_games(task):
+    ''' Play a shard of the games of a tournament in a worker process
+
+    Args:
+        task (tuple): (number of games, seed, checkpoint, timeout)
+
+    Returns:
+        (tuple): The result of tournament_totals
+    '''
+    num, seed, checkpoint, timeout = task
+    env = _worker['env']
+    agents = [_load_agent(agent, checkpoint, timeout) if isinstance(agent, str) else agent
+              for agent in _worker['agents']]
+    env.set_agents(agents)
+    env.seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    return tournament_totals(env, num)
+
+
+class PendingTournament(object):
+    ''' The result of a tournament played in the background
+    '''
+
+    def __init__(self, results, num_players):
+        self._results = results
+        self._num_players = num_players
+
+    def ready(self):
+        ''' Check if all the games are played
+
+        Returns:
+            (boolean): True if get returns without waiting
+        '''
+        return all(result.ready() for result in self._results)
+
+    def get(self, timeout=None):
+        ''' Wait for the games and aggregate them like tournament
+
+        Args:
+            timeout (float): The number of seconds to wait for each shard
+
+        Returns:
+            (tuple): A list of average payoffs for each player, and the
+                     probability of each player to finish at each place
+        '''
+        payoffs = [0.0 for _ in range(self._num_players)]
+        win_probs = [[0.0, 0.0, 0.0, 0.0] for _ in range(self._num_players)]
+        counter = 0
+        for result in self._results:
+            _payoffs, _win_probs, _counter = result.get(timeout)
+            for i in range(self._num_players):
+                payoffs[i] += float(_payoffs[i])
+                for j in range(len(win_probs[i])):
+                    win_probs[i][j] += _win_probs[i][j]
+            counter += _counter
+        for i in range(self._num_players):
+            payoffs[i] /= counter
+            for j in range(len(win_probs[i])):
+                win_probs[i][j] /= counter
+        return payoffs, win_probs
+
+
+class ParallelTournament(object):
+    ''' Evaluate agents like tournament, with the games sharded across a
+    pool of worker processes
+
+    Every worker has its own env and a copy of the agents. An agent given as
+    a model directory is a CFRAgent that the workers load read-only from a
+    checkpoint, memory-mapped, so the evaluation can run while the agent
+    keeps training and writing new checkpoints.
+    '''
+
+    def __init__(self, env_config, agents, num_workers, seed=None, checkpoint_timeout=600):
+        ''' Start the workers
+
+        Args:
+            env_config (dict): The config of the env of every worker
+            agents (list): One entry per player, an agent or the model
+                           directory of a CFRAgent
+            num_workers (int): The number of worker processes
+            seed (int): The seed of the first shard of every tournament.
+                        Shard i uses seed + i
+            checkpoint_timeout (float): The number of seconds a worker waits
+                                        for a checkpoint to be written
+        '''
+        self.num_players = len(agents)
+        self.num_workers = num_workers
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_workers)
+        self.seed = seed
+        self.checkpoint_timeout = checkpoint_timeout
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                         initargs=(env_config, agents))
+
+    def run_async(self, num, checkpoint=None):
+        ''' Start a tournament in the background
+
+        Args:
+            num (int): The number of games to play
+            checkpoint (str): The checkpoint version to load the CFRAgents
+                              given as model directories from, e.g. the
+                              submitted attribute of a CheckpointWriter. The
+                              workers wait until it is written, so the
+                              writer must keep it until the result is in.
+                              None loads the newest version when a shard
+                              starts
+
+        Returns:
+            (PendingTournament): The result
+        '''
+        shards = [num // self.num_workers + (1 if i < num % self.num_workers else 0)
+                  for i in range(self.num_workers)]
+        results = [self.pool.apply_async(_play_games, ((shard, self.seed + i, checkpoint,
+                                                        self.checkpoint_timeout),))
+                   for i, shard in enumerate(shards) if shard > 0]
+        return PendingTournament(results, self.num_players)
+
+    def run(self, num, checkpoint=None):
+        ''' Play a tournament
+
+        Args:
+            num (int): The number of games to play
+            checkpoint (str): See run_async
+
+        Returns:
+            (tuple): A list of average payoffs for each player, and the
+                     probability of each player to finish at each place
+        '''
+        return self.run_async(num, checkpoint).get()
+
+    def close(self):
+        ''' Stop the workers
+        '''
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -200,19 +200,25 @@ def reorganize(trajectories, payoffs):
     return new_trajectories
 
 
-def remove_illegal(action_probs, legal_actions):
+def remove_illegal(action_probs, legal_actions, out=None):
     ''' Remove illegal actions and normalize the
         probability vector
 
     Args:
         action_probs (numpy.array): A 1 dimention numpy array.
         legal_actions (list): A list of indices of legal actions.
+        out (numpy.array): A float array to write the result into instead of
+            a new one. It must not be action_probs
 
     Returns:
         probd (numpy.array): A normalized vector without legal actions.
     '''
     # print(action_probs,legal_actions)
-    probs = np.zeros(action_probs.shape[0])
+    if out is None:
+        probs = np.zeros(action_probs.shape[0])
+    else:
+        probs = out
+        probs[:] = 0
     probs[legal_actions] = action_probs[legal_actions]
     if np.sum(probs) == 0:
         probs[legal_actions] = 1 / len(legal_actions)
@@ -221,6 +227,55 @@ def remove_illegal(action_probs, legal_actions):
     return probs
 
 
+def masked_probs(action_probs, legal_mask, out=None):
+    ''' Remove illegal actions and normalize the probability vector in place,
+        given the legal action mask of the state
+
+    Args:
+        action_probs (numpy.array): A 1 dimention numpy array.
+        legal_mask (numpy.array): A boolean or uint8 array, nonzero for the
+            legal actions, e.g. state['legal_mask']
+        out (numpy.array): A float array to write the result into. It may be
+            action_probs itself. None writes into action_probs
+
+    Returns:
+        (numpy.array): out, normalized over the legal actions. If no legal
+            action has a positive probability, uniform over them
+    '''
+    if out is None:
+        out = action_probs
+    np.multiply(action_probs, legal_mask, out=out)
+    total = out.sum()
+    if total == 0:
+        out[:] = legal_mask
+        total = out.sum()
+    out /= total
+    return out
+
+
+def sample_masked(action_probs, legal_mask, out, np_random=np.random):
+    ''' Sample a legal action without normalizing the probabilities
+
+    Args:
+        action_probs (numpy.array): A 1 dimention numpy array.
+        legal_mask (numpy.array): A boolean or uint8 array, nonzero for the
+            legal actions
+        out (numpy.array): A float scratch array as long as action_probs. It
+            may be action_probs itself, which is then overwritten
+        np_random (numpy.random.RandomState): The random generator
+
+    Returns:
+        (int): The sampled action. If no legal action has a positive
+            probability, it is uniform over the legal actions
+    '''
+    np.multiply(action_probs, legal_mask, out=out)
+    np.cumsum(out, out=out)
+    if out[-1] == 0:
+        out[:] = legal_mask
+        np.cumsum(out, out=out)
+    return int(np.searchsorted(out, np_random.random_sample() * out[-1], side='right'))
+
+
 def tournament(env, num):
     ''' Evaluate he performance of the agents in the environment
 
@@ -231,6 +286,26 @@ def tournament(env, num):
     Returns:
         A list of avrage payoffs for each player
     '''
+    payoffs, win_probs, counter = tournament_totals(env, num)
+    for i, _ in enumerate(payoffs):
+        payoffs[i] /= counter
+    for i in range(len(win_probs)):
+        for j in range(len(win_probs[i])):
+            win_probs[i][j] /= counter
+    return payoffs,win_probs
+
+
+def tournament_totals(env, num):
+    ''' Play games like tournament, without averaging the results
+
+    Args:
+        env (Env class): The environment to be evaluated.
+        num (int): The number of games to play.
+
+    Returns:
+        (tuple): The summed payoffs of each player, the number of times each
+                 player finished at each place, and the number of games
+    '''
     payoffs = [0 for _ in range(env.num_players)]
     win_probs = [[0, 0, 0, 0] for _ in range(env.num_players)]
     counter = 0
@@ -249,9 +324,4 @@ def tournament(env, num):
         winner_id = env.game.winner_id
         for i in range(len(winner_id)):
             win_probs[winner_id[i]][i] += 1
-    for i, _ in enumerate(payoffs):
-        payoffs[i] /= counter
-    for i in range(len(win_probs)):
-        for j in range(len(win_probs[i])):
-            win_probs[i][j] /= counter
-    return payoffs,win_probs
+    return payoffs, win_probs, counter